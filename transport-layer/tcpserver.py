@@ -1,6 +1,12 @@
 import socket, sys
 import json
+import mmap
+import os
 import time
+import heapq
+import itertools
+import queue
+import selectors
 import threading
 import uuid
 
@@ -12,8 +18,102 @@ IDX_LENGTH = 2 # 2 bytes of packet index
 HEADER_SIZE = 1 + 16 + IDX_LENGTH  # 1 byte for packet type, 16 bytes for session ID, 2 bytes for packet index
 PKTSIZE = 8190
 BUFSIZE = PKTSIZE + HEADER_SIZE  # buffer size for receiving packets, including header
-WINDOW_SIZE = 16
-TIMEOUT = 0.5   # timeout time
+INITIAL_WINDOW = 10  # congestion window of a new session, in packets (RFC 6928)
+MAX_WINDOW = 512  # upper bound of the congestion window, what SOCKET_BUFFER holds
+SOCKET_BUFFER = 4 * 1024 * 1024  # kernel buffer asked for, room for the windows of many sessions
+TIMEOUT = 0.5   # initial retransmission timeout, until a session has measured its round trip time
+# RTT samples include up to ACK_DELAY of receiver hold time and the queueing delay of a full
+# window, so the RTO floor sits well above both (200 ms, as Linux)
+MIN_RTO = 0.2  # bounds of the computed retransmission timeout
+MAX_RTO = 10
+RTT_ALPHA = 1 / 8  # gains of the smoothed RTT and RTT variance estimates (Jacobson/Karels, RFC 6298)
+RTT_BETA = 1 / 4
+CLOCK_GRANULARITY = 0.001
+ACK_EVERY = 2  # in-order DATA packets per ACK
+ACK_DELAY = 0.01  # longest an in-order DATA packet waits for its ACK
+MAX_SACK_BYTES = MAX_WINDOW // 8  # SACK bitmap covers at most a full window past the cumulative ACK
+DUPACK_THRESHOLD = 3  # packets acknowledged above a hole before it counts as lost
+MAX_READS = 64  # packets read per loop turn before due timers get to run
+MAX_COMPLETED = 1024  # finished receiving sessions remembered to re-ACK late DATA
+COMPLETED_LINGER = 2 * MAX_RTO  # how long a finished receiving session is remembered
+
+class Reno():
+    # AIMD congestion control (RFC 5681): slow start grows cwnd by a packet per ACK, doubling it
+    # every RTT, up to ssthresh; congestion avoidance then adds one packet per RTT. A loss halves
+    # cwnd, a timeout restarts slow start from one packet
+    def __init__(self):
+        self.cwnd = INITIAL_WINDOW
+        self.ssthresh = MAX_WINDOW
+
+    def on_ack(self, now, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, MAX_WINDOW)
+
+    def on_loss(self, now):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = 1
+
+
+class Cubic():
+    # CUBIC (RFC 9438): after a loss, cwnd follows a cubic of the time since, flattening out at the
+    # window where the loss happened (w_max) and probing beyond it, so its growth does not depend
+    # on the RTT. It never grows slower than Reno would (the w_est estimate). Slow start as Reno
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self):
+        self.cwnd = INITIAL_WINDOW
+        self.ssthresh = MAX_WINDOW
+        self.w_max = 0
+        self.w_est = 0
+        self.k = 0
+        self.epoch_start = None  # start of the current congestion avoidance epoch
+
+    def on_ack(self, now, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd = min(self.cwnd + 1, MAX_WINDOW)
+            return
+
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_max = max(self.w_max, self.cwnd)
+            self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+            self.w_est = self.cwnd
+
+        # aim for the cubic's value one RTT from now, at most 1.5 times the current window
+        t = now - self.epoch_start + srtt
+        target = min(max(self.C * (t - self.k) ** 3 + self.w_max, self.cwnd), 1.5 * self.cwnd)
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) / self.cwnd
+        self.cwnd += (target - self.cwnd) / self.cwnd
+        self.cwnd = min(max(self.cwnd, self.w_est), MAX_WINDOW)
+
+    def reduce(self):
+        # fast convergence: a loss below the last w_max means another flow took bandwidth, so
+        # release some of it by aiming lower
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, 2)
+        self.epoch_start = None
+
+    def on_loss(self, now):
+        self.reduce()
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, now):
+        self.reduce()
+        self.cwnd = 1
+
+
+CONGESTION_CONTROLS = {"reno": Reno, "cubic": Cubic}
 
 class Server():
     def __init__(self, config_file):
@@ -30,22 +130,118 @@ class Server():
         self.peers = config["peers"]
         self.content_info = config["content_info"] # list of filenames
         self.peer_info = config["peer_info"]  # list of peer info, each peer info is a dict with hostname, port, content info
+        self.congestion_control = config.get("congestion_control", "cubic") # algorithm of the sending sessions
+        if self.congestion_control not in CONGESTION_CONTROLS:
+            print(f"[DEBUG] Unknown congestion control '{self.congestion_control}', must be one of {list(CONGESTION_CONTROLS)}")
+            sys.exit(1)
 
         # establish a socket according to the information
         print(f"[DEBUG] Starting server on {self.hostname}:{self.port}")
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) #NOTE THAT THE SOCK_DGRAM will ensure your socket is UDP
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind(("", self.port)) #This is the only port you can use to receive
-        self.server_socket.settimeout(1) # timeout value
+        # every session shares this socket, so a burst of full windows must fit in its buffers
+        # (the kernel caps these at net.core.rmem_max / wmem_max)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+        self.server_socket.setblocking(False) # the event loop only reads when the selector says so
+
+        # one loop drives every session: the selector waits for packets on the socket or a wake-up
+        # from the CLI thread, for at most the time until the earliest timer in the heap is due
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.commands = queue.SimpleQueue() # file names from the CLI, handled on the loop
+        self.timers = [] # heap of (deadline, tiebreak, callback, args)
+        self.timer_ids = itertools.count()
 
         # track sessions on the server
         self.sessions = {} # session_id -> session info
+        self.files = {} # file name -> shared mapping of a file being sent
+        self.completed = {} # session_id -> total_packets of a finished receiving session, oldest first
 
         # initialize the server
         self.remain_threads = True
         self.cli()
 
 
+    def schedule(self, delay, callback, *args):
+        # run callback(*args) on the loop after delay seconds. Timers are never cancelled: a
+        # callback checks that the session still needs it when it fires
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timer_ids), callback, args))
+
+
+    def run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.timers)
+            callback(*args)
+
+
+    def rtt_sample(self, session, rtt):
+        # fold one round trip time into the session's smoothed RTT and variance and recompute its
+        # RTO, which also ends any backoff. Only packets sent exactly once give samples (Karn's
+        # rule): the ACK of a retransmitted packet could belong to either send
+        if session["srtt"] is None:
+            session["srtt"] = rtt
+            session["rttvar"] = rtt / 2
+        else:
+            session["rttvar"] = (1 - RTT_BETA) * session["rttvar"] + RTT_BETA * abs(session["srtt"] - rtt)
+            session["srtt"] = (1 - RTT_ALPHA) * session["srtt"] + RTT_ALPHA * rtt
+        rto = session["srtt"] + max(CLOCK_GRANULARITY, 4 * session["rttvar"])
+        session["rto"] = min(max(rto, MIN_RTO), MAX_RTO)
+
+
+    def backoff(self, session, sent_at):
+        # double the RTO after a timeout. A lost window times out packet by packet, but only the
+        # sends made since the last backoff double it again, so one loss event backs off once;
+        # returns whether this timeout started a new loss event
+        if sent_at < session["backoff_at"]:
+            return False
+        session["rto"] = min(2 * session["rto"], MAX_RTO)
+        session["backoff_at"] = time.monotonic()
+        return True
+
+
+    def session_stats(self, session):
+        # congestion and throughput figures of a sending session
+        elapsed = time.monotonic() - session["started"]
+        return {
+            "cwnd": session["cc"].cwnd,
+            "ssthresh": session["cc"].ssthresh,
+            "max_cwnd": session["max_cwnd"],
+            "srtt": session["srtt"],
+            "rto": session["rto"],
+            "acked_bytes": session["acked_bytes"],
+            "throughput": session["acked_bytes"] / elapsed if elapsed > 0 else 0,  # bytes/sec
+            "retransmits": session["retransmits"],
+            "timeouts": session["timeouts"],
+            "fast_retransmits": session["fast_retransmits"],
+        }
+
+
+    def print_stats(self, session_id):
+        stats = self.session_stats(self.sessions[session_id])
+        srtt = f"{stats['srtt'] * 1e3:.2f} ms" if stats["srtt"] is not None else "none"
+        print(f"[STATS] Session {session_id.hex()}: {stats['acked_bytes']} bytes acked at {stats['throughput'] / 1e6:.2f} MB/s, "
+              f"cwnd {stats['cwnd']:.1f} (max {stats['max_cwnd']:.1f}, ssthresh {stats['ssthresh']:.1f}), "
+              f"SRTT {srtt}, RTO {stats['rto'] * 1e3:.1f} ms, {stats['retransmits']} retransmits ({stats['fast_retransmits']} fast), {stats['timeouts']} timeouts")
+
+
+    def send(self, packet, addr, data=None):
+        # data, if given, is a payload buffer sent after the header without copying it into the packet
+        try:
+            if data is None:
+                self.server_socket.sendto(packet, addr)
+            else:
+                self.server_socket.sendmsg([packet, data], [], 0, addr)
+        except BlockingIOError:
+            # socket buffer full: treat the packet as lost, the retransmit timer sends it again
+            print(f"[DEBUG] Send buffer full, dropped packet of type {packet[0]} to {addr}")
+
+
     def find_file(self, file_name):
         # returns a tuple of (hostname, port) of the peer that has the file
         print(f"[DEBUG] Looking for file '{file_name}' in peer list")
@@ -59,18 +255,39 @@ class Server():
         return None
 
 
-    def read_file(self, file_name):
-        # read the file and return a list of packets of size PKTSIZE
-        print(f"[DEBUG] Reading file: {file_name}")
-        packets = []
-        with open(file_name, 'rb') as f:
-            while True:
-                chunk = f.read(PKTSIZE)
-                if not chunk:
-                    break
-                packets.append(chunk)
-        print(f"[DEBUG] Read complete. Total packets: {len(packets)}")
-        return packets
+    def packet_count(self, file_name):
+        # number of PKTSIZE packets the file splits into, from its size alone
+        return (os.stat(file_name).st_size + PKTSIZE - 1) // PKTSIZE
+
+
+    def map_file(self, file_name):
+        # a read-only memoryview of the whole file, mapped once and shared by every session
+        # sending it; packet i is the slice [i * PKTSIZE:(i + 1) * PKTSIZE] of it
+        mapping = self.files.get(file_name)
+        if mapping is None:
+            print(f"[DEBUG] Mapping file: {file_name}")
+            with open(file_name, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    data = None  # mmap cannot map an empty file
+                    view = memoryview(b"")
+                else:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    view = memoryview(data)
+            mapping = self.files[file_name] = {"mmap": data, "view": view, "sessions": 0}
+        mapping["sessions"] += 1
+        return mapping["view"]
+
+
+    def unmap_file(self, file_name):
+        # called as a sending session ends; the last one out closes the mapping
+        mapping = self.files[file_name]
+        mapping["sessions"] -= 1
+        if mapping["sessions"] == 0:
+            mapping["view"].release()
+            if mapping["mmap"] is not None:
+                mapping["mmap"].close()
+            del self.files[file_name]
+            print(f"[DEBUG] Unmapped file: {file_name}")
 
 
     def receive(self, file_name):
@@ -82,7 +299,6 @@ class Server():
             return
 
         session_id = uuid.uuid4().bytes  # generate a unique session ID
-        filename_bytes = file_name.encode()
 
         # create session entry (receiver side)
         self.sessions[session_id] = {
@@ -90,78 +306,100 @@ class Server():
             "filename": file_name,
             "total_packets": 0,  # will be set after receiving SYN-ACK
             "received": [],  # to keep track of received packets
-            "lock": threading.Lock(),  # lock for thread safety
             "complete": False,  # set to True when all packets are received
             "syn_ack_received": False,  # flag to check if SYN-ACK is received
             "syn_last_sent": 0,  # last time SYN was sent
+            "rto": TIMEOUT,  # retransmission timeout of the SYN, doubled on every resend
+            "backoff_at": 0,
         }
 
-        # send SYN packet
-        def syn_transmit():
-            while not self.sessions[session_id]["syn_ack_received"]:
-                now = time.time()
-                if now - self.sessions[session_id]["syn_last_sent"] > TIMEOUT:
-                    syn_packet = bytearray()
-                    syn_packet.append(0x00)  # SYN packet type
-                    syn_packet.extend(session_id)  # append session ID
-                    syn_packet.append(len(filename_bytes))  # append length of filename
-                    syn_packet.extend(filename_bytes)  # append filename
-                    self.server_socket.sendto(syn_packet, addr)
-                    self.sessions[session_id]["syn_last_sent"] = now  # update last sent time
-                    print(f"[DEBUG] Sent SYN to {addr} for file '{file_name}' with session ID {session_id.hex()}")
-                time.sleep(0.1)  # sleep to avoid busy waiting
+        # send SYN packets until SYN-ACK is received
+        self.send_syn(session_id)
+
+
+    def send_syn(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session["syn_ack_received"]:
+            return
+
+        if session["syn_last_sent"]:
+            # the timer fired with no SYN-ACK back: the SYN or the answer was lost
+            self.backoff(session, session["syn_last_sent"])
+
+        filename_bytes = session["filename"].encode()
+        syn_packet = bytearray()
+        syn_packet.append(0x00)  # SYN packet type
+        syn_packet.extend(session_id)  # append session ID
+        syn_packet.append(len(filename_bytes))  # append length of filename
+        syn_packet.extend(filename_bytes)  # append filename
+        self.send(syn_packet, session["addr"])
+        print(f"[DEBUG] Sent SYN to {session['addr']} for file '{session['filename']}' with session ID {session_id.hex()}")
+        session["syn_last_sent"] = time.monotonic()  # update last sent time
+        self.schedule(session["rto"], self.send_syn, session_id)
 
-        # start a thread to send SYN packets until SYN-ACK is received
-        threading.Thread(target=syn_transmit).start()
 
+    def transmit(self, session_id):
+        session = self.sessions[session_id]
+        print(f"[DEBUG] Starting transmission to {session['addr']} for file {session['filename']}")
+
+        session["data"] = self.map_file(session["filename"])  # packets are slices of the mapped file
+        session["started"] = time.monotonic()
 
-    def transmit(self, file_name, addr, session_id):
-        print(f"[DEBUG] Starting transmission to {addr} for file {file_name}")
+        print(f"[DEBUG] Total packets to transmit: {session['total_packets']}")
+        self.fill_window(session_id)
 
+
+    def fill_window(self, session_id):
+        # send every packet the congestion window allows; called again whenever an ACK moves the base
         session = self.sessions[session_id]
-        packets = self.read_file(file_name)  # read the file and get packets
-
-        print(f"[DEBUG] Total packets to transmit: {len(packets)}")
-
-        while session["base"] < session["total_packets"]:
-            with session["lock"]:
-                # send packets in the window
-                while session["next_seq"] < session["base"] + WINDOW_SIZE and session["next_seq"] < session["total_packets"]:
-                    if session["timeout_status"][session["next_seq"]] == 0:
-                        data_packet = bytearray()
-                        data_packet.append(0x03)  # Data packet type
-                        data_packet.extend(session_id)  # append session ID
-
-                        packet_index = session["next_seq"].to_bytes(IDX_LENGTH, 'big')
-                        data_packet.extend(packet_index)  # append packet index
-                        data_packet.extend(packets[session["next_seq"]])  # append packet data
-                        self.server_socket.sendto(data_packet, addr)
-                        session["timeout_status"][session["next_seq"]] = time.time()  # record the time of sending
-                        print(f'[DEBUG] Sent packet {session["next_seq"] + 1}/{session["total_packets"]} to {addr}')
-
-                    session["next_seq"] += 1
-
-                # check for timeouts and resend packets if necessary
-                for i in range(session["base"], min(session["base"] + WINDOW_SIZE, session["total_packets"])):
-                    if not session["acked"][i] and session["timeout_status"][i] > 0 and time.time() - session["timeout_status"][i] > TIMEOUT:
-                        # resend the packet if it has timed out
-                        data_packet = bytearray()
-                        data_packet.append(0x03)
-                        data_packet.extend(session_id)  # append session ID
-
-                        packet_index = i.to_bytes(IDX_LENGTH, 'big')
-                        data_packet.extend(packet_index)  # append packet index
-                        data_packet.extend(packets[i])  # append packet data
-                        self.server_socket.sendto(data_packet, addr)
-                        session["timeout_status"][i] = time.time()  # update the timeout status
-                        print(f'[DEBUG] Resent packet {i + 1}/{session["total_packets"]} to {addr} due to timeout')
-
-                while session["base"] < session["total_packets"] and session["acked"][session["base"]]:
-                    # move the base forward if the ACK is for the base packet
-                    session["base"] += 1
-                    print(f'[DEBUG] Base moved to {session["base"]} for session ID {session_id.hex()}')
-
-            time.sleep(0.1)  # sleep to avoid busy waiting
+        window = max(int(session["cc"].cwnd), 1)
+        while session["next_seq"] < session["base"] + window and session["next_seq"] < session["total_packets"]:
+            if session["timeout_status"][session["next_seq"]] == 0:
+                self.send_data(session_id, session["next_seq"])
+                print(f'[DEBUG] Sent packet {session["next_seq"] + 1}/{session["total_packets"]} to {session["addr"]}')
+
+            session["next_seq"] += 1
+
+
+    def send_data(self, session_id, index):
+        session = self.sessions[session_id]
+        data_packet = bytearray()
+        data_packet.append(0x03)  # Data packet type
+        data_packet.extend(session_id)  # append session ID
+
+        packet_index = index.to_bytes(IDX_LENGTH, 'big')
+        data_packet.extend(packet_index)  # append packet index
+        packet_data = session["data"][index * PKTSIZE:(index + 1) * PKTSIZE]  # zero-copy slice of the mapping
+        self.send(data_packet, session["addr"], packet_data)
+
+        sent_at = time.monotonic()
+        session["timeout_status"][index] = sent_at  # record the time of sending
+        self.schedule(session["rto"], self.data_timeout, session_id, index, sent_at)
+
+
+    def data_timeout(self, session_id, index, sent_at):
+        # retransmit timer of one send of one packet; stale once the packet is ACKed (-1) or sent again
+        session = self.sessions.get(session_id)
+        if session is None or session["timeout_status"][index] != sent_at:
+            return
+
+        if self.backoff(session, sent_at):
+            session["timeouts"] += 1
+            session["cc"].on_timeout(time.monotonic())
+            session["recovery"] = session["next_seq"]
+
+        # only the lowest unacknowledged packet is resent now; the rest of the packets in flight
+        # are requeued (which also makes their timers stale) and go out again as cwnd allows
+        base = session["base"]
+        for i in range(base, session["next_seq"]):
+            if session["timeout_status"][i] > 0:
+                session["timeout_status"][i] = 0
+                session["retransmitted"][i] = True  # its ACK can no longer be timed
+        session["next_seq"] = base
+        session["retransmits"] += 1
+        self.send_data(session_id, base)
+        print(f'[DEBUG] Resent packet {base + 1}/{session["total_packets"]} to {session["addr"]} due to timeout, RTO now {session["rto"] * 1e3:.1f} ms')
+        self.fill_window(session_id)
 
 
     def handle_syn(self, packet, addr):
@@ -171,7 +409,12 @@ class Server():
 
         print(f"[DEBUG] Received SYN from {addr} for file '{filename}' with session ID {session_id.hex()}")
 
-        total_packets = len(self.read_file(filename))  # get the total number of packets for the file
+        if session_id in self.sessions:
+            # a retransmitted SYN; the SYN-ACK timer is already running for this session
+            print(f"[DEBUG] Session ID {session_id.hex()} already exists.")
+            return
+
+        total_packets = self.packet_count(filename)  # get the total number of packets for the file
         print(f"[DEBUG] Total packets for file '{filename}': {total_packets}")
 
         # create a session entry (sender side)
@@ -183,28 +426,48 @@ class Server():
             "next_seq": 0,
             "timeout_status": [0] * total_packets,  # -1 = ACKed, 0 = not sent, >0 = last sent time
             "acked": [False] * total_packets,  # to keep track of which packets have been acknowledged
-            "lock": threading.Lock(),  # lock for thread safety
+            "retransmitted": [False] * total_packets,  # packets sent more than once give no RTT sample
             "ready": False,  # set to True after ACK
             "ack_received": False,  # flag to check if ACK is received
             "syn_ack_last_sent": 0,  # last time SYN-ACK was sent
+            "syn_ack_retransmitted": False,
+            "srtt": None,  # smoothed round trip time, None until the first sample
+            "rttvar": 0,  # round trip time variation
+            "rto": TIMEOUT,  # current retransmission timeout
+            "backoff_at": 0,  # time of the last RTO backoff
+            "cc": CONGESTION_CONTROLS[self.congestion_control](),  # owns the congestion window
+            "started": 0,  # start of transmission, for the throughput
+            "acked_bytes": 0,
+            "max_cwnd": 0,
+            "retransmits": 0,
+            "timeouts": 0,  # loss events found by the retransmission timer
+            "fast_retransmits": 0,
+            "highest_acked": -1,  # highest packet index acknowledged
+            "latest_acked_sent": 0,  # latest send time of any acknowledged packet
+            "recovery": 0,  # next_seq when the last loss event began; it ends once base passes it
         }
 
-        # send SYN-ACK response
-        def syn_ack_transmit():
-            while not self.sessions[session_id]["ack_received"]:
-                now = time.time()
-                if now - self.sessions[session_id]["syn_ack_last_sent"] > TIMEOUT:
-                    syn_ack_packet = bytearray()
-                    syn_ack_packet.append(0x01)
-                    syn_ack_packet.extend(session_id)  # append session ID
-                    syn_ack_packet.extend(total_packets.to_bytes(2, 'big'))  # append total packets count
-                    self.server_socket.sendto(syn_ack_packet, addr)
-                    self.sessions[session_id]["syn_ack_last_sent"] = now  # update last sent time
-                    print(f"[DEBUG] Sent SYN-ACK to {addr} for session ID {session_id.hex()} with total packets {total_packets}")
-                time.sleep(0.1)  # sleep to avoid busy waiting
+        # send SYN-ACK packets until ACK is received
+        self.send_syn_ack(session_id)
+
 
-        # start a thread to send SYN-ACK packets until ACK is received
-        threading.Thread(target=syn_ack_transmit).start()
+    def send_syn_ack(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session["ack_received"]:
+            return
+
+        if session["syn_ack_last_sent"]:
+            self.backoff(session, session["syn_ack_last_sent"])
+            session["syn_ack_retransmitted"] = True
+
+        syn_ack_packet = bytearray()
+        syn_ack_packet.append(0x01)
+        syn_ack_packet.extend(session_id)  # append session ID
+        syn_ack_packet.extend(session["total_packets"].to_bytes(2, 'big'))  # append total packets count
+        self.send(syn_ack_packet, session["addr"])
+        print(f"[DEBUG] Sent SYN-ACK to {session['addr']} for session ID {session_id.hex()} with total packets {session['total_packets']}")
+        session["syn_ack_last_sent"] = time.monotonic()  # update last sent time
+        self.schedule(session["rto"], self.send_syn_ack, session_id)
 
 
     def handle_syn_ack(self, packet, addr):
@@ -216,15 +479,21 @@ class Server():
         # update session entry (receiver side)
         if session_id in self.sessions:
             session = self.sessions[session_id]
-            session["total_packets"] = total_packets
-            session["received"] = [None] * total_packets
-            session["syn_ack_received"] = True  # mark SYN-ACK as received
+            if not session["syn_ack_received"]:
+                session["total_packets"] = total_packets
+                session["received"] = [None] * total_packets
+                session["received_count"] = 0
+                session["next_expected"] = 0  # cumulative ACK: every packet below it has arrived
+                session["highest"] = -1  # highest packet index received
+                session["unacked"] = 0  # packets received since the last ACK was sent
+                session["ack_timer"] = False  # a delayed ACK is scheduled
+                session["syn_ack_received"] = True  # mark SYN-ACK as received
 
         # send ACK response
         response = bytearray()
         response.append(0x02)  # ACK packet type
         response.extend(session_id)  # append session ID
-        self.server_socket.sendto(response, addr)
+        self.send(response, addr)
         print(f"[DEBUG] Sent ACK to {addr} for session ID {session_id.hex()}")
 
 
@@ -237,16 +506,18 @@ class Server():
             return
 
         session = self.sessions[session_id]
-        session["ack_received"] = True  # mark ACK as received
+        # check if sender side and mark as ready; a duplicate ACK must not start a second transmission
+        if "ready" not in session or session["ready"]:
+            return
 
-        # check if sender side and mark as ready
-        if "ready" in session:
-            with session["lock"]:
-                session["ready"] = True
-                print(f"[DEBUG] Session {session_id.hex()} is now ready for transmission.")
+        # the handshake gives the first RTT sample, so DATA starts with a measured RTO
+        session["ack_received"] = True  # mark ACK as received
+        if not session["syn_ack_retransmitted"]:
+            self.rtt_sample(session, time.monotonic() - session["syn_ack_last_sent"])
+        session["ready"] = True
+        print(f"[DEBUG] Session {session_id.hex()} is now ready for transmission.")
 
-        threading.Thread(target=self.transmit, args=(session["filename"], addr, session_id)).start()
-        print(f"[DEBUG] Transmission thread started for session ID {session_id.hex()}")
+        self.transmit(session_id)
 
 
     def handle_data(self, packet, addr):
@@ -257,28 +528,45 @@ class Server():
         print(f"[DEBUG] Received DATA from {addr} for session ID {session_id.hex()} and packet index {packet_index}")
 
         if session_id not in self.sessions:
-            print(f"[DEBUG] Session ID {session_id.hex()} not found in sessions.")
+            # a finished session whose last ACK was lost: everything was received, so ACK the
+            # whole file and the sender can finish and release its mapping of the file instead
+            # of retransmitting forever. DATA of any other unknown session is dropped
+            if session_id in self.completed:
+                self.send_sack(session_id, addr, self.completed[session_id])
+            else:
+                print(f"[DEBUG] Session ID {session_id.hex()} not found in sessions.")
             return
 
         session = self.sessions[session_id]
-        with session["lock"]:
-            if packet_index < len(session["received"]):
-                if not session["received"][packet_index]:
-                    session["received"][packet_index] = packet_data
-                    print(f"[DEBUG] Packet {packet_index} received for session ID {session_id.hex()}")
-
-                    # check if all packets are received
-                    if all(packet is not None for packet in session["received"]):
-                        session["complete"] = True
-                        print(f"[DEBUG] All packets received for session ID {session_id.hex()}. Transmission complete.")
-
-                # send DATA-ACK back to the sender
-                ack_packet = bytearray()
-                ack_packet.append(0x04)
-                ack_packet.extend(session_id)  # append session ID
-                ack_packet.extend(packet_index.to_bytes(IDX_LENGTH, 'big'))  # append packet index
-                self.server_socket.sendto(ack_packet, session["addr"])
-                print(f"[DEBUG] Sent DATA-ACK for packet {packet_index} to {session['addr']} for session ID {session_id.hex()}")
+        if packet_index >= len(session["received"]):
+            return
+
+        # ACK at once when the packet is a duplicate, lands beyond a gap or fills one, so the
+        # sender learns of losses without delay; in-order packets are ACKed every ACK_EVERY
+        # packets or after ACK_DELAY, whichever comes first
+        immediate = session["received"][packet_index] is not None or packet_index != session["next_expected"]
+        if session["received"][packet_index] is None:
+            session["received"][packet_index] = packet_data
+            session["received_count"] += 1
+            session["highest"] = max(session["highest"], packet_index)
+            print(f"[DEBUG] Packet {packet_index} received for session ID {session_id.hex()}")
+
+            while session["next_expected"] < session["total_packets"] and session["received"][session["next_expected"]] is not None:
+                session["next_expected"] += 1
+            immediate = immediate or session["highest"] >= session["next_expected"]
+
+            # check if all packets are received
+            if session["received_count"] == session["total_packets"]:
+                session["complete"] = True
+                immediate = True
+                print(f"[DEBUG] All packets received for session ID {session_id.hex()}. Transmission complete.")
+
+        session["unacked"] += 1
+        if immediate or session["unacked"] >= ACK_EVERY:
+            self.send_sack(session_id, session["addr"])
+        elif not session["ack_timer"]:
+            session["ack_timer"] = True
+            self.schedule(ACK_DELAY, self.delayed_ack, session_id)
 
         # if the session is complete, write the file
         if session["complete"]:
@@ -292,12 +580,91 @@ class Server():
             except Exception as e:
                 print(f'[DEBUG] Error writing file {session["filename"]}: {e}')
 
+            # clean up the session, remembering it long enough to answer retransmitted DATA
+            del self.sessions[session_id]
+            self.remember_completed(session_id, session["total_packets"])
+            print(f"[DEBUG] Session {session_id.hex()} cleaned up.")
+
+
+    def remember_completed(self, session_id, total_packets):
+        # bounded record of finished receiving sessions: the oldest is dropped once MAX_COMPLETED
+        # are held, and each expires after COMPLETED_LINGER
+        self.completed[session_id] = total_packets
+        if len(self.completed) > MAX_COMPLETED:
+            del self.completed[next(iter(self.completed))]
+        self.schedule(COMPLETED_LINGER, self.completed.pop, session_id, None)
+
+
+    def delayed_ack(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        session["ack_timer"] = False
+        if session["unacked"]:
+            self.send_sack(session_id, session["addr"])
+
+
+    def send_sack(self, session_id, addr, cumulative=None):
+        # ACK packet: every packet below the cumulative index has arrived, and bit i of the
+        # bitmap (most significant bit of the first byte first) marks packet cumulative + 1 + i
+        # as received out of order. cumulative is given for a session that no longer exists
+        bitmap = b""
+        if cumulative is None:
+            session = self.sessions[session_id]
+            session["unacked"] = 0
+            cumulative = session["next_expected"]
+            last = min(session["highest"], cumulative + 8 * MAX_SACK_BYTES)
+            if last > cumulative:
+                received = session["received"]
+                bits = "".join("0" if received[i] is None else "1" for i in range(cumulative + 1, last + 1))
+                bits += "0" * (-len(bits) % 8)
+                bitmap = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+
+        ack_packet = bytearray()
+        ack_packet.append(0x05)
+        ack_packet.extend(session_id)  # append session ID
+        ack_packet.extend(cumulative.to_bytes(IDX_LENGTH, 'big'))  # append cumulative ACK index
+        ack_packet.extend(bitmap)  # append SACK bitmap
+        self.send(ack_packet, addr)
+        print(f"[DEBUG] Sent SACK up to packet {cumulative} with {len(bitmap)}-byte bitmap to {addr} for session ID {session_id.hex()}")
+
+
+    def ack_packet(self, session, packet_index):
+        # mark one packet of a sending session as acknowledged
+        session["acked"][packet_index] = True
+        session["timeout_status"][packet_index] = -1
+        session["acked_bytes"] += len(session["data"][packet_index * PKTSIZE:(packet_index + 1) * PKTSIZE])
+        session["cc"].on_ack(time.monotonic(), session["srtt"] or session["rto"])
+        session["max_cwnd"] = max(session["max_cwnd"], session["cc"].cwnd)
+        session["highest_acked"] = max(session["highest_acked"], packet_index)
+
+
+    def advance(self, session_id):
+        # move the base past acknowledged packets, then finish the session or refill its window
+        session = self.sessions[session_id]
+        while session["base"] < session["total_packets"] and session["acked"][session["base"]]:
+            # move the base forward if the ACK is for the base packet
+            session["base"] += 1
+        print(f'[DEBUG] Base moved to {session["base"]} for session ID {session_id.hex()}')
+
+        if session["base"] == session["total_packets"]:
+            # if all packets are acknowledged, mark the session as complete
+            session["complete"] = True
+            print(f"[DEBUG] All packets acknowledged for session ID {session_id.hex()}. Transmission complete.")
+            self.print_stats(session_id)
+
             # clean up the session
+            self.unmap_file(session["filename"])
             del self.sessions[session_id]
             print(f"[DEBUG] Session {session_id.hex()} cleaned up.")
+            return
+
+        # the window may have opened, send what it now allows straight away
+        self.fill_window(session_id)
 
 
     def handle_data_ack(self, packet, addr):
+        # per-packet DATA-ACK of peers that do not send SACKs yet
         session_id = packet[:16]
         packet_index = int.from_bytes(packet[16:18], 'big')  # next 2 bytes are the packet index
 
@@ -308,53 +675,166 @@ class Server():
             return
 
         session = self.sessions[session_id]
-        with session["lock"]:
-            if not session["acked"][packet_index]:
-                session["acked"][packet_index] = True
-                session["timeout_status"][packet_index] = -1
-                print(f"[DEBUG] Packet {packet_index} acknowledged for session ID {session_id.hex()}")
+        if packet_index >= session["total_packets"] or session["acked"][packet_index]:
+            return
+        if not session["retransmitted"][packet_index]:
+            self.rtt_sample(session, time.monotonic() - session["timeout_status"][packet_index])
+        self.ack_packet(session, packet_index)
+        print(f"[DEBUG] Packet {packet_index} acknowledged for session ID {session_id.hex()}")
+        self.advance(session_id)
 
-        if all(session["acked"]):
-            # if all packets are acknowledged, mark the session as complete
-            session["complete"] = True
-            print(f"[DEBUG] All packets acknowledged for session ID {session_id.hex()}. Transmission complete.")
 
-            # clean up the session
-            del self.sessions[session_id]
-            print(f"[DEBUG] Session {session_id.hex()} cleaned up.")
+    def handle_sack(self, packet, addr):
+        session_id = packet[:16]
+        cumulative = int.from_bytes(packet[16:18], 'big')  # next 2 bytes are the cumulative ACK index
+        bitmap = packet[18:]  # the rest is the SACK bitmap
 
+        print(f"[DEBUG] Received SACK up to packet {cumulative} from {addr} for session ID {session_id.hex()}")
 
-    def listener(self): # listen to the socket to see if there's any transmission request
-        print(f"[DEBUG] Listening on port {self.port}")
+        if session_id not in self.sessions or "acked" not in self.sessions[session_id]:
+            print(f"[DEBUG] Session ID {session_id.hex()} not found in sessions.")
+            return
 
-        while self.remain_threads:
+        session = self.sessions[session_id]
+        total_packets = session["total_packets"]
+        newly_acked = [i for i in range(session["base"], min(cumulative, total_packets)) if not session["acked"][i]]
+        if bitmap:
+            bits = format(int.from_bytes(bitmap, 'big'), f"0{8 * len(bitmap)}b")
+            newly_acked += [cumulative + 1 + i for i, bit in enumerate(bits)
+                            if bit == "1" and cumulative + 1 + i < total_packets and not session["acked"][cumulative + 1 + i]]
+        if not newly_acked:
+            return
+
+        # one RTT sample per ACK, from the latest-sent packet it covers that was sent only once
+        now = time.monotonic()
+        sample_sent = 0
+        for i in newly_acked:
+            sent_at = session["timeout_status"][i]
+            session["latest_acked_sent"] = max(session["latest_acked_sent"], sent_at)
+            if not session["retransmitted"][i]:
+                sample_sent = max(sample_sent, sent_at)
+            self.ack_packet(session, i)
+        if sample_sent:
+            self.rtt_sample(session, now - sample_sent)
+
+        # fast retransmit (IsLost of RFC 6675): a packet is lost once DUPACK_THRESHOLD higher
+        # packets are acknowledged and a packet sent after it has been, so a retransmission is
+        # only judged lost again once something sent later gets through. The acknowledged
+        # packets above each hole are counted walking down from the highest one
+        lost = []
+        above = 0
+        for i in range(session["highest_acked"], session["base"] - 1, -1):
+            if session["acked"][i]:
+                above += 1
+            elif above >= DUPACK_THRESHOLD and i < session["next_seq"] and 0 < session["timeout_status"][i] < session["latest_acked_sent"]:
+                lost.append(i)
+        for i in reversed(lost):
+            self.fast_retransmit(session_id, i)
+
+        self.advance(session_id)
+
+
+    def fast_retransmit(self, session_id, index):
+        session = self.sessions[session_id]
+        session["retransmitted"][index] = True  # its ACK can no longer be timed
+        session["retransmits"] += 1
+        session["fast_retransmits"] += 1
+        if session["base"] >= session["recovery"]:
+            # the first loss of a window is the loss event the congestion window reacts to;
+            # losses among the packets already sent when it was found are part of the same event
+            session["cc"].on_loss(time.monotonic())
+            session["recovery"] = session["next_seq"]
+        self.send_data(session_id, index)
+        print(f'[DEBUG] Fast retransmitted packet {index + 1}/{session["total_packets"]} to {session["addr"]}')
+
+
+    def handle_packet(self, packet, addr):
+        pkt_type = packet[0] # first byte indicates the type of packet
+        if pkt_type == 0x00: # SYN packet (received by server)
+            self.handle_syn(packet[1:], addr)
+        elif pkt_type == 0x01: # SYN-ACK packet (received by client)
+            self.handle_syn_ack(packet[1:], addr)
+        elif pkt_type == 0x02: # ACK packet (received by server)
+            self.handle_ack(packet[1:], addr)
+        elif pkt_type == 0x03: # Data packet (received by client)
+            self.handle_data(packet[1:], addr)
+        elif pkt_type == 0x04: # DATA-ACK packet (received by server)
+            self.handle_data_ack(packet[1:], addr)
+        elif pkt_type == 0x05: # SACK packet (received by server)
+            self.handle_sack(packet[1:], addr)
+        else:
+            print(f"[DEBUG] Unknown packet type {pkt_type} received from {addr}")
+
+
+    def read_packets(self):
+        # drain the socket, up to MAX_READS packets so a flood cannot hold off the timers
+        for _ in range(MAX_READS):
             try:
                 packet, addr = self.server_socket.recvfrom(BUFSIZE)
-                if not packet:
-                    print("[DEBUG] No data received, continuing to listen.")
-                    continue
-
-                pkt_type = packet[0] # first byte indicates the type of packet
-                if pkt_type == 0x00: # SYN packet (received by server)
-                    self.handle_syn(packet[1:], addr)
-                elif pkt_type == 0x01: # SYN-ACK packet (received by client)
-                    self.handle_syn_ack(packet[1:], addr)
-                elif pkt_type == 0x02: # ACK packet (received by server)
-                    self.handle_ack(packet[1:], addr)
-                elif pkt_type == 0x03: # Data packet (received by client)
-                    self.handle_data(packet[1:], addr)
-                elif pkt_type == 0x04: # DATA-ACK packet (received by server)
-                    self.handle_data_ack(packet[1:], addr)
+            except BlockingIOError:
+                return
+            if not packet:
+                print("[DEBUG] No data received, continuing to listen.")
+                continue
+            self.handle_packet(packet, addr)
+
+
+    def read_commands(self):
+        # clear the wake-up bytes, then run what the CLI queued: "stats" prints every sending
+        # session's congestion window and throughput, anything else is a file name to receive
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if command == "stats":
+                for session_id, session in list(self.sessions.items()):
+                    if session.get("started"):
+                        self.print_stats(session_id)
+            else:
+                self.receive(command)
+
+
+    def listener(self): # event loop: packets, CLI requests and retransmit timers of every session
+        print(f"[DEBUG] Listening on port {self.port}")
+
+        while self.remain_threads:
+            timeout = None  # nothing scheduled: sleep until a packet or a command arrives
+            if self.timers:
+                timeout = max(0, self.timers[0][0] - time.monotonic())
+
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.server_socket:
+                    self.read_packets()
                 else:
-                    print(f"[DEBUG] Unknown packet type {pkt_type} received from {addr}")
+                    self.read_commands()
 
-            # no data received, continue listening
-            except socket.timeout:
-                continue
+            self.run_timers()
 
         print("[DEBUG] Listener thread exiting.")
 
 
+    def wake(self):
+        # interrupt the listener's select from another thread
+        self.wakeup_send.send(b"\0")
+
+
+    def shutdown(self, listen_thread):
+        self.remain_threads = False
+        self.wake()
+        listen_thread.join()
+        self.selector.close()
+        self.server_socket.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+
     def cli(self):  # cli interface for input of the file name
         listen_thread = threading.Thread(target=self.listener)
         listen_thread.start()
@@ -364,21 +844,18 @@ class Server():
                 command_line = input()
                 if command_line == "kill":
                     print("[DEBUG] Shutting down server.")
-                    self.remain_threads = False
-                    self.server_socket.close()
-                    listen_thread.join()
+                    self.shutdown(listen_thread)
                     print("[DEBUG] Server shutdown complete.")
                     break
 
-                # otherwise input is a file name to load
+                # otherwise input is "stats" or a file name to load, handed to the listener's loop
                 print(f"[DEBUG] CLI input received: {command_line}")
-                self.receive(command_line.strip())
+                self.commands.put(command_line.strip())
+                self.wake()
 
             except EOFError:
                 print("[DEBUG] EOFError encountered. Exiting CLI.")
-                self.remain_threads = False
-                self.server_socket.close()
-                listen_thread.join()
+                self.shutdown(listen_thread)
                 break
 
 
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from ofdm import ofdm_modulate
+from phy import MAX_MESSAGE_LENGTH, WifiPhy
+from sync import find_start_index
+from viterbi import hard_vdecoder
+
+DEFAULT_SIZES = [10, 100, 1000, MAX_MESSAGE_LENGTH]
+DEFAULT_SNRS = [0, 2, 4, 6, 8, 10]
+
+
+def random_message(rng, size):
+    return "".join(chr(c) for c in rng.integers(32, 127, size))
+
+
+def _timed(timings, stage, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+    return result
+
+
+def stage_times(phy, message, repeats, snr=20):
+    # one packet through every stage of the level-4 chain, each stage timed on its own;
+    # returns seconds per packet for each stage
+    nfft = phy.nfft
+    timings = {}
+    for _ in range(repeats):
+        bits = _timed(timings, "interleave", phy.level1_encode, message)
+        coded = _timed(timings, "conv_encode", phy.conv_encode, bits[2*nfft:])
+        stream = np.concatenate((phy.preamble, bits[:2*nfft], coded))
+        symbols = _timed(timings, "qam_modulate", phy.modulate, stream)
+        samples = _timed(timings, "ofdm_modulate", ofdm_modulate, symbols, nfft)
+        received, _, _ = _timed(timings, "channel", phy.channel, samples, snr)
+
+        start = _timed(timings, "sync", find_start_index, received, phy.preamble_time) + len(phy.preamble_time)
+        span = _timed(timings, "sync", phy.packet_span, received[None, start:start + nfft])[0]
+        symbols = _timed(timings, "ofdm_demodulate", phy.ofdm.demodulate, received[start:start + span])
+        demod = _timed(timings, "qam_demodulate", phy.demodulate_hard, symbols)
+        decoded = _timed(timings, "viterbi", hard_vdecoder, demod[2*nfft:], phy.trellis_tables)
+        payloads, _ = _timed(timings, "deinterleave", phy.level1_decode, demod[None, :2*nfft], decoded[None, :])
+        if payloads[0].decode("latin-1") != message:
+            raise Exception("Error: Stage benchmark did not round trip")
+    return {stage: seconds / repeats for stage, seconds in timings.items()}
+
+
+def level_throughput(phy, message, level, repeats):
+    # packets/sec of transmit and receive at one level, and the peak memory of one round trip
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            output = phy.transmit(message, level, 20)
+        transmit_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            phy.receive(output, level)
+        receive_time = (time.perf_counter() - start) / repeats
+
+        tracemalloc.start()
+        phy.receive(phy.transmit(message, level, 20), level)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {"transmit_packets_per_sec": 1 / transmit_time, "receive_packets_per_sec": 1 / receive_time, "peak_memory_bytes": peak}
+
+
+def per_sweep(phy, rng, size, snrs, packets, decodings=("hard", "soft")):
+    # packet error rate against SNR through the level-4 channel (padding + AWGN)
+    messages = [random_message(rng, size) for _ in range(packets)]
+    clean = [phy.transmit(message, 3) for message in messages]
+    curves = {decoding: {} for decoding in decodings}
+    for snr in snrs:
+        received = [phy.channel(samples, snr)[0] for samples in clean]
+        for decoding in decodings:
+            results = phy.receive_batch(received, 4, decoding)
+            errors = sum(result[1] != message for result, message in zip(results, messages))
+            curves[decoding][str(snr)] = errors / packets
+    return curves
+
+
+def compare(results, baseline, tolerance):
+    # throughput entries that dropped by more than tolerance against a saved run
+    regressions = []
+    for level, sizes in baseline.get("levels", {}).items():
+        for size, old in sizes.items():
+            new = results["levels"].get(level, {}).get(size)
+            if new is None:
+                continue
+            for key in ("transmit_packets_per_sec", "receive_packets_per_sec"):
+                if new[key] < old[key] * (1 - tolerance):
+                    regressions.append(f"level {level}, {size} chars, {key}: {old[key]:,.0f} -> {new[key]:,.0f}")
+    return regressions
+
+
+def run(sizes=DEFAULT_SIZES, snrs=DEFAULT_SNRS, repeats=20, packets=100, per_size=100, seed=0, backend='numpy', dtype='complex128', nfft=64):
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+    phy = WifiPhy(nfft, backend=backend, dtype=dtype)
+    results = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "seed": seed, "backend": backend, "dtype": dtype, "nfft": nfft},
+        "stages": {},
+        "levels": {},
+    }
+
+    for size in sizes:
+        message = random_message(rng, size)
+        results["stages"][str(size)] = stage_times(phy, message, repeats)
+        for level in range(1, 5):
+            results["levels"].setdefault(str(level), {})[str(size)] = level_throughput(phy, message, level, repeats)
+
+    results["per"] = {"message_size": per_size, "packets": packets, "curves": per_sweep(phy, rng, per_size, snrs, packets)}
+    return results
+
+
+def report(results):
+    for size, stages in results["stages"].items():
+        total = sum(stages.values())
+        print(f"{size} chars, level-4 stages ({total * 1e3:.2f} ms/packet): " + ", ".join(f"{stage} {seconds * 1e3:.2f} ms" for stage, seconds in stages.items()))
+    for level, sizes in results["levels"].items():
+        for size, entry in sizes.items():
+            print(f"Level {level}, {size} chars: transmit {entry['transmit_packets_per_sec']:,.0f} packets/sec, receive {entry['receive_packets_per_sec']:,.0f} packets/sec, peak {entry['peak_memory_bytes'] / 1e6:.2f} MB")
+    per = results["per"]
+    print(f"Packet error rate, {per['packets']} packets of {per['message_size']} chars:")
+    for decoding, curve in per["curves"].items():
+        print(f"  {decoding}: " + ", ".join(f"{snr} dB {rate:.2f}" for snr, rate in curve.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the WiFi PHY transmit/receive chains")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="message sizes in characters")
+    parser.add_argument("--snrs", type=float, nargs="+", default=DEFAULT_SNRS, help="SNRs (dB) for the packet error rate sweep")
+    parser.add_argument("--repeats", type=int, default=20, help="packets timed per level and size")
+    parser.add_argument("--packets", type=int, default=100, help="packets per SNR in the sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "commpy"], help="modulation/encoding/channel implementation")
+    parser.add_argument("--nfft", type=int, default=64, choices=[64, 128, 256, 512, 1024], help="OFDM symbol size")
+    parser.add_argument("--dtype", default="complex128", choices=["complex64", "complex128"], help="receiver working precision")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for throughput regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional throughput drop against --compare")
+    args = parser.parse_args()
+
+    if any(size > MAX_MESSAGE_LENGTH for size in args.sizes):
+        raise Exception("Error: Message is too long")
+
+    results = run(args.sizes, args.snrs, args.repeats, args.packets, seed=args.seed, backend=args.backend, dtype=args.dtype, nfft=args.nfft)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import os
+import struct
+import sys
+import numpy as np
+from phy import WifiPhy
+
+# on-disk layout (little endian):
+#   header  magic 8s | version u16 | level u16 | snr f64 | num_samples u64 | num_packets u64 | data_offset u64 | nfft u16,
+#           padded to 64 bytes (version 1 files end before nfft and were all written with nfft 64)
+#   samples complex64 * num_samples, starting at data_offset
+#   offsets u64 * num_packets, the sample index where each packet's preamble starts
+MAGIC = b"WPHYCAP\0"
+VERSION = 2
+HEADER = struct.Struct("<8sHHdQQQH")
+HEADER_V1 = struct.Struct("<8sHHdQQQ")
+HEADER_SIZE = 64
+SAMPLE_DTYPE = np.dtype("<c8")
+OFFSET_DTYPE = np.dtype("<u8")
+
+Capture = namedtuple("Capture", ["level", "snr", "samples", "offsets", "nfft"])
+
+
+def _read_header(f):
+    f.seek(0)
+    header = f.read(HEADER.size)
+    magic, version, level, snr, num_samples, num_packets, data_offset = HEADER_V1.unpack_from(header)
+    if magic != MAGIC:
+        raise Exception("Error: Not a PHY capture file")
+    if version not in (1, VERSION):
+        raise Exception(f"Error: Unsupported capture version {version}")
+    nfft = HEADER.unpack(header)[-1] if version >= 2 else 64
+    return level, snr, num_samples, num_packets, data_offset, nfft
+
+
+class CaptureWriter:
+    # writes (or appends to) a capture file; the offset table lives after the samples and is
+    # rewritten on close, so new packets can be appended to an existing corpus. The symbol size
+    # recorded in the header is the phy's
+    def __init__(self, path, level=4, snr=np.inf, append=False, phy=None):
+        if level > 4 or level < 2:
+            raise Exception("Error: Captures hold samples, level must be 2-4")
+        self.phy = phy if phy is not None else WifiPhy()
+        self.offsets = []
+
+        if append and os.path.exists(path):
+            self.file = open(path, "r+b")
+            self.level, self.snr, self.num_samples, num_packets, data_offset, nfft = _read_header(self.file)
+            if (self.level, self.snr, nfft) != (level, snr, self.phy.nfft):
+                raise Exception("Error: Appended packets must match the capture's level, SNR and nfft")
+            self.file.seek(data_offset + self.num_samples * SAMPLE_DTYPE.itemsize)
+            self.offsets = np.frombuffer(self.file.read(num_packets * OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE).tolist()
+            self.file.seek(data_offset + self.num_samples * SAMPLE_DTYPE.itemsize)
+            self.file.truncate()
+        else:
+            self.file = open(path, "w+b")
+            self.level, self.snr, self.num_samples = level, snr, 0
+            self._write_header()
+
+    def write_samples(self, samples, packet_offsets=()):
+        # raw samples, with the preamble offsets (relative to these samples) of the packets they hold
+        samples = np.asarray(samples, dtype=SAMPLE_DTYPE)
+        self.offsets.extend(self.num_samples + int(offset) for offset in packet_offsets)
+        self.file.write(samples.tobytes())
+        self.num_samples += len(samples)
+
+    def write_packet(self, message):
+        # transmit message at the capture's level and append it, recording where its preamble starts
+        if self.level >= 4:
+            samples, pad_begin, _ = self.phy.channel(self.phy.transmit(message, 3), self.snr)
+        else:
+            samples, pad_begin = self.phy.transmit(message, self.level), 0
+        self.write_samples(samples, [pad_begin])
+
+    def close(self):
+        self.file.write(np.asarray(self.offsets, dtype=OFFSET_DTYPE).tobytes())
+        self._write_header()
+        self.file.close()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.level, self.snr, self.num_samples, len(self.offsets), HEADER_SIZE, self.phy.nfft).ljust(HEADER_SIZE, b"\0"))
+        self.file.seek(HEADER_SIZE + self.num_samples * SAMPLE_DTYPE.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_capture(path):
+    # header and offsets are read eagerly, samples are memory-mapped and paged in on access
+    with open(path, "rb") as f:
+        level, snr, num_samples, num_packets, data_offset, nfft = _read_header(f)
+        f.seek(data_offset + num_samples * SAMPLE_DTYPE.itemsize)
+        offsets = np.frombuffer(f.read(num_packets * OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE).astype(np.int64)
+    samples = np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", offset=data_offset, shape=(num_samples,)) if num_samples else np.zeros(0, dtype=SAMPLE_DTYPE)
+    return Capture(level, snr, samples, offsets, nfft)
+
+
+# build a benchmark corpus in two appending sessions and decode it back from the memory map
+if __name__ == "__main__":
+    import tempfile
+    import time
+    from pipeline import decode_capture
+
+    num_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.mkdtemp(), "corpus.cap")
+
+    rng = np.random.default_rng(0)
+    messages = ["".join(chr(c) for c in rng.integers(32, 127, int(rng.integers(1, 500)))) for _ in range(num_packets)]
+    start = time.perf_counter()
+    with CaptureWriter(path, 4, 15) as writer:
+        for message in messages[:num_packets // 2]:
+            writer.write_packet(message)
+    with CaptureWriter(path, 4, 15, append=True) as writer:
+        for message in messages[num_packets // 2:]:
+            writer.write_packet(message)
+    print(f"Wrote {num_packets} packets to {path} ({os.path.getsize(path) / 1e6:.1f} MB) in {time.perf_counter() - start:.2f} s")
+
+    capture = read_capture(path)
+    print(f"Level {capture.level}, SNR {capture.snr}, nfft {capture.nfft}, {len(capture.samples):,} samples, {len(capture.offsets)} packet offsets")
+
+    results, timings = decode_capture(path)
+    correct = sum(result[1] == message for result, message in zip(results, messages))
+    print(f"Decoded {correct}/{num_packets} from the memory-mapped capture in {timings['total']:.2f} s")
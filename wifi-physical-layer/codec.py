@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import sys
+import time
+import numpy as np
+
+# numpy backend for the one configuration the PHY uses: 4-QAM and the rate-1/2 (0o7, 0o5)
+# convolutional code, with the bit conventions of commpy's QAMModem(4) and conv_encode
+
+# commpy's QAMModem(4) constellation; the symbol index is the 2-bit value, first bit as MSB
+QPSK_CONSTELLATION = np.array([-1-1j, -1+1j, 1-1j, 1+1j])
+
+# generators over (current input, previous input, the one before), MSB first; like
+# commpy's Trellis(np.array([3]), ...) the trellis keeps three past inputs, the oldest untapped
+GENERATORS = (0o7, 0o5)
+MEMORY = 3
+
+# the fields of commpy's Trellis that build_trellis_tables reads
+ConvTrellis = namedtuple("ConvTrellis", ["number_states", "k", "n", "next_state_table", "output_table"])
+
+
+def qpsk_modulate(bits):
+    # table lookup on bit pairs, over the last axis of any (..., 2*nsym) bit array
+    bits = np.asarray(bits, dtype=np.uint8)
+    pairs = bits.reshape(bits.shape[:-1] + (-1, 2))
+    return QPSK_CONSTELLATION[2 * pairs[..., 0] + pairs[..., 1]]
+
+
+def qpsk_demodulate_hard(symbols):
+    # the nearest constellation point of a QPSK symbol is given by the signs of its two parts;
+    # a part of exactly 0 is equally far from both points and, like commpy's argmin, decodes to 0
+    symbols = np.asarray(symbols)
+    bits = np.empty(symbols.shape + (2,), dtype=np.int8)
+    bits[..., 0] = symbols.real > 0
+    bits[..., 1] = symbols.imag > 0
+    return bits.reshape(symbols.shape[:-1] + (-1,))
+
+
+def qpsk_demodulate_soft(symbols):
+    # max-log LLRs (positive favours a 1): the two points nearest to each bit value differ only
+    # in that bit's axis, so the squared-distance difference reduces to 4 * real or 4 * imag
+    symbols = np.asarray(symbols)
+    llrs = np.empty(symbols.shape + (2,))
+    llrs[..., 0] = 4 * symbols.real
+    llrs[..., 1] = 4 * symbols.imag
+    return llrs.reshape(symbols.shape[:-1] + (-1,))
+
+
+def conv_encode(bits, generators=GENERATORS):
+    # shift-register encoder as XORs of delayed copies of the input, over the last axis of any
+    # (..., nbits) array; the register starts at zero and no tail bits are appended, which is
+    # commpy's conv_encode output without its termination bits
+    bits = np.asarray(bits, dtype=np.uint8)
+    memory = max(generators).bit_length() - 1
+    pad = [(0, 0)] * (bits.ndim - 1) + [(memory, 0)]
+    padded = np.pad(bits, pad)
+    num_bits = bits.shape[-1]
+    output = np.zeros(bits.shape + (len(generators),), dtype=np.uint8)
+    for j, generator in enumerate(generators):
+        for delay in range(memory + 1):
+            if (generator >> (memory - delay)) & 1:
+                output[..., j] ^= padded[..., memory - delay:memory - delay + num_bits]
+    return output.reshape(bits.shape[:-1] + (-1,))
+
+
+def conv_trellis(generators=GENERATORS, memory=MEMORY):
+    # trellis of the encoder above, numbered like commpy's: the state is the last `memory`
+    # inputs, newest as MSB, and the generators tap the newest end of (input, state)
+    number_states = 2 ** memory
+    states = np.arange(number_states)[:, None]
+    inputs = np.arange(2)[None, :]
+    register = (inputs << memory) | states
+    next_state_table = register >> 1
+    output_table = np.zeros((number_states, 2), dtype=np.int64)
+    for generator in generators:
+        taps = generator << (memory + 1 - generator.bit_length())
+        parity = np.zeros_like(register)
+        for bit in range(memory + 1):
+            parity ^= (register >> bit) & (taps >> bit) & 1
+        output_table = (output_table << 1) | parity
+    return ConvTrellis(number_states, 1, len(generators), next_state_table, output_table)
+
+
+def awgn(input_signal, snr_dB, rate=1.0, rng=None):
+    # commpy.channels.awgn without importing commpy; it draws the same np.random numbers, so a
+    # seeded run adds the same noise (up to rounding of the vectorized average energy). rng, a
+    # np.random.Generator, replaces the global state for independent reproducible streams
+    randn = np.random.randn if rng is None else rng.standard_normal
+    input_signal = np.asarray(input_signal)
+    avg_energy = np.sum(np.abs(input_signal) ** 2) / len(input_signal)
+    snr_linear = 10 ** (snr_dB / 10.0)
+    noise_variance = avg_energy / (2 * rate * snr_linear)
+
+    if np.iscomplexobj(input_signal):
+        noise = (np.sqrt(noise_variance) * randn(len(input_signal))) + (np.sqrt(noise_variance) * randn(len(input_signal)) * 1j)
+    else:
+        noise = np.sqrt(2 * noise_variance) * randn(len(input_signal))
+
+    return input_signal + noise
+
+
+class QpskModem:
+    # drop-in for the parts of commpy's QAMModem(4) the PHY uses
+    constellation = QPSK_CONSTELLATION
+    num_bits_symbol = 2
+
+    def modulate(self, input_bits):
+        return qpsk_modulate(input_bits)
+
+    def demodulate(self, input_symbols, demod_type):
+        if demod_type == 'hard':
+            return qpsk_demodulate_hard(input_symbols)
+        if demod_type == 'soft':
+            return qpsk_demodulate_soft(input_symbols)
+        raise Exception("Error: demod_type must be 'hard' or 'soft'")
+
+
+# check every function bit-exact against commpy and compare speed
+if __name__ == "__main__":
+    import commpy.channelcoding.convcode as check
+    import commpy.modulation
+
+    num_bits = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    bits = rng.integers(0, 2, num_bits)
+    modem = commpy.modulation.QAMModem(4)
+    trellis = check.Trellis(np.array([3]), np.array([[0o7, 0o5]]))
+
+    def timed(func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    reference, reference_time = timed(lambda: check.conv_encode(bits.astype(bool), trellis)[:-6])
+    encoded, encoded_time = timed(conv_encode, bits)
+    print(f"conv_encode      bit-exact: {np.array_equal(reference, encoded)}, {reference_time / encoded_time:,.0f}x faster")
+
+    reference, reference_time = timed(modem.modulate, bits.astype(bool))
+    symbols, symbols_time = timed(qpsk_modulate, bits)
+    print(f"QPSK modulate    bit-exact: {np.array_equal(reference, symbols)}, {reference_time / symbols_time:,.0f}x faster")
+
+    received = symbols + (rng.normal(size=len(symbols)) + 1j * rng.normal(size=len(symbols))) * 0.5
+    reference, reference_time = timed(modem.demodulate, received, 'hard')
+    demod, demod_time = timed(qpsk_demodulate_hard, received)
+    print(f"QPSK demodulate  bit-exact: {np.array_equal(reference, demod)}, {reference_time / demod_time:,.0f}x faster")
+
+    import commpy.channels
+    signal = symbols[:20000]
+    np.random.seed(1)
+    reference = commpy.channels.awgn(signal, 5)
+    np.random.seed(1)
+    print(f"AWGN             max difference: {np.abs(reference - awgn(signal, 5)).max():.1e}")
+
+    numpy_trellis = conv_trellis()
+    print("Trellis tables identical:", numpy_trellis.number_states == trellis.number_states
+          and np.array_equal(numpy_trellis.next_state_table, trellis.next_state_table)
+          and np.array_equal(numpy_trellis.output_table, trellis.output_table))
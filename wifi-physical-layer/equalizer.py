@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import sys
+import numpy as np
+
+# the PHY has no cyclic prefix, so equalization assumes channels much shorter than a symbol
+EQUALIZERS = ('zf', 'mmse')
+
+
+def estimate_channel(preamble_samples, preamble_symbols, max_taps=None):
+    # per-subcarrier channel of the received time-domain preambles, (batch, nfft), against the
+    # known frequency-domain preamble symbols; returns (H, noise variance per subcarrier), each
+    # per packet. The least-squares estimate Y / X is smoothed by keeping only the impulse
+    # response taps a short channel can have (the first max_taps, default nfft // 4, and a few
+    # at the end for a sync point that landed late); the energy in the dropped taps is noise
+    # and gives the noise estimate MMSE needs
+    preamble_samples = np.atleast_2d(preamble_samples)
+    nfft = preamble_samples.shape[-1]
+    max_taps = max_taps or nfft // 4
+    late = max(1, max_taps // 4)
+
+    impulse = np.fft.ifft(np.fft.fft(preamble_samples, axis=-1) / preamble_symbols, axis=-1)
+    noise_taps = impulse[:, max_taps:nfft - late]
+    # each LS subcarrier carries noise / X with |X|^2 = 2, spread evenly over the nfft taps
+    noise_var = 2 * nfft * np.mean(np.abs(noise_taps) ** 2, axis=-1)
+    impulse[:, max_taps:nfft - late] = 0
+    return np.fft.fft(impulse, axis=-1), noise_var
+
+
+def equalizer_weights(channel, noise_var, method='zf'):
+    # per-subcarrier weights that undo the channel by one multiply: zero-forcing 1/H, or MMSE
+    # conj(H) / (|H|^2 + noise / Es), which stops deep fades from amplifying the noise
+    if method not in EQUALIZERS:
+        raise Exception(f"Error: Unsupported equalizer, must be one of {EQUALIZERS}")
+    channel = np.atleast_2d(channel)
+    if method == 'zf':
+        return 1 / np.where(channel == 0, 1e-12, channel)
+    symbol_energy = 2  # QPSK points are +-1+-1j
+    return np.conj(channel) / (np.abs(channel) ** 2 + np.asarray(noise_var)[..., None] / symbol_energy)
+
+
+def equalize(symbols, weights):
+    # apply (batch, nfft) weights to every OFDM symbol of (batch, nsym * nfft) frequency-domain
+    # symbols in place, as one broadcast multiply; a trailing partial symbol is left alone
+    nfft = weights.shape[-1]
+    full = symbols.shape[-1] // nfft * nfft
+    view = symbols[..., :full].reshape(symbols.shape[:-1] + (-1, nfft))
+    view *= weights[..., None, :]
+    return symbols
+
+
+def exponential_taps(num_taps, decay=3.0, rng=None):
+    # random complex taps with an exponential power-delay profile (power falling by e every
+    # decay taps), normalized to unit energy so the channel does not change the SNR on average
+    rng = rng if rng is not None else np.random.default_rng()
+    power = np.exp(-np.arange(num_taps) / decay)
+    taps = np.sqrt(power / 2) * (rng.standard_normal(num_taps) + 1j * rng.standard_normal(num_taps))
+    return taps / np.sqrt(np.sum(np.abs(taps) ** 2))
+
+
+def multipath(samples, taps):
+    # the samples through a static multipath channel, cut to their original length
+    return np.convolve(samples, taps)[:len(samples)]
+
+
+# packet error rate over random multipath channels with and without equalization, and the SNR
+# each receiver needs to hold a fixed packet error rate
+if __name__ == "__main__":
+    import time
+    from phy import WifiPhy
+
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_taps = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    decay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    decoding = sys.argv[4] if len(sys.argv) > 4 else "soft"
+    target_per = 0.2
+    snrs = list(range(0, 31, 3))
+    rng = np.random.default_rng(0)
+    message = "".join(chr(c) for c in rng.integers(32, 127, 100))
+
+    receivers = {"none": WifiPhy(), "zf": WifiPhy(equalizer='zf'), "mmse": WifiPhy(equalizer='mmse')}
+    clean = receivers["none"].transmit(message, 3)
+    channels = [exponential_taps(num_taps, decay, rng) for _ in range(packets)]
+    print(f"{packets} packets of {len(message)} chars per point, {num_taps}-tap multipath (decay {decay}), {decoding} decoding")
+    print("SNR(dB)  packet error rate / delivered packets per 100 sent")
+    print("        " + "".join(f"{name:>14}" for name in receivers))
+    required = {}
+    timings = dict.fromkeys(receivers, 0.0)
+    for snr in snrs:
+        received = [receivers["none"].channel(multipath(clean, taps), snr, rng)[0] for taps in channels]
+        rates = {}
+        for name, phy in receivers.items():
+            start = time.perf_counter()
+            results = phy.receive_batch(received, 4, decoding)
+            timings[name] += time.perf_counter() - start
+            rates[name] = sum(result[1] != message for result in results) / packets
+            if rates[name] <= target_per and name not in required:
+                required[name] = snr
+        print(f"{snr:7d} " + "".join(f"{rate:8.3f} / {100 * (1 - rate):3.0f}" for rate in rates.values()))
+
+    for name in receivers:
+        print(f"{name:>4}: PER <= {target_per} from {required.get(name, 'beyond ' + str(snrs[-1]))} dB, "
+              f"receive {len(snrs) * packets / timings[name]:,.0f} packets/sec")
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import struct
+import sys
+import zlib
+import numpy as np
+from phy import MAX_MESSAGE_LENGTH, WifiPhy
+from streaming import StreamingReceiver
+
+# every packet carries sequence number | fragment count | crc32, big endian; the crc covers the
+# sequence number and count as well as the fragment, so a corrupted header is caught too
+FRAGMENT_HEADER = struct.Struct(">III")
+FRAGMENT_INDEX = struct.Struct(">II")
+MAX_FRAGMENT_SIZE = MAX_MESSAGE_LENGTH - FRAGMENT_HEADER.size
+
+
+def fragment(payload, fragment_size=MAX_FRAGMENT_SIZE):
+    # split a payload of any size into packets that each fit in one PHY message
+    if fragment_size < 1 or fragment_size > MAX_FRAGMENT_SIZE:
+        raise Exception(f"Error: Fragment size must be 1-{MAX_FRAGMENT_SIZE}")
+    payload = payload.encode('latin-1') if isinstance(payload, str) else bytes(payload)
+    total = max(1, -(-len(payload) // fragment_size))
+    packets = []
+    for seq in range(total):
+        chunk = payload[seq * fragment_size:(seq + 1) * fragment_size]
+        crc = zlib.crc32(chunk, zlib.crc32(FRAGMENT_INDEX.pack(seq, total)))
+        packets.append(FRAGMENT_HEADER.pack(seq, total, crc) + chunk)
+    return packets
+
+
+def parse_fragment(packet):
+    # (seq, total, chunk) of a received packet, or None if it is too short or fails its crc
+    if len(packet) < FRAGMENT_HEADER.size:
+        return None
+    seq, total, crc = FRAGMENT_HEADER.unpack_from(packet)
+    chunk = packet[FRAGMENT_HEADER.size:]
+    if seq >= total or zlib.crc32(chunk, zlib.crc32(FRAGMENT_INDEX.pack(seq, total))) != crc:
+        return None
+    return seq, total, chunk
+
+
+def transmit_frames(payload, snr=np.inf, phy=None, fragment_size=MAX_FRAGMENT_SIZE):
+    # every fragment modulated (level 3) and placed back to back in one stream, which then goes
+    # through the level-4 channel once: random padding at both ends and AWGN over the whole stream
+    phy = phy if phy is not None else WifiPhy()
+    stream = np.concatenate([phy.transmit(packet, 3) for packet in fragment(payload, fragment_size)])
+    output, _, _ = phy.channel(stream, snr)
+    return output
+
+
+class Reassembler:
+    # collects fragments in any order; payload is available once every sequence number is in
+    def __init__(self):
+        self.total = None
+        self.fragments = {}
+        self.rejected = 0
+
+    def add(self, packet):
+        parsed = parse_fragment(packet)
+        if parsed is None or (self.total is not None and parsed[1] != self.total):
+            self.rejected += 1
+            return
+        seq, self.total, chunk = parsed
+        self.fragments[seq] = chunk
+
+    def missing(self):
+        if self.total is None:
+            return None
+        return [seq for seq in range(self.total) if seq not in self.fragments]
+
+    def payload(self):
+        if self.total is None or self.missing():
+            return None
+        return b"".join(self.fragments[seq] for seq in range(self.total))
+
+
+def receive_frames(samples, phy=None, chunk_samples=1 << 16, decoding='hard'):
+    # detect and decode every packet of a framed stream with the streaming receiver and put the
+    # payload back together; samples is one array or an iterable of sample chunks. Returns
+    # (payload, missing sequence numbers), with payload None unless every fragment arrived
+    chunks = samples
+    if isinstance(samples, np.ndarray):
+        chunks = (samples[i:i + chunk_samples] for i in range(0, len(samples), chunk_samples))
+    receiver = StreamingReceiver(phy, decoding=decoding, raw=True)
+    reassembler = Reassembler()
+    for chunk in chunks:
+        for _, packet, _ in receiver.feed(chunk):
+            reassembler.add(packet)
+    for _, packet, _ in receiver.flush():
+        reassembler.add(packet)
+    return reassembler.payload(), reassembler.missing()
+
+
+# push a large random payload through the PHY in one call and report aggregate throughput
+if __name__ == "__main__":
+    import time
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    snr = float(sys.argv[2]) if len(sys.argv) > 2 else 15
+    phy = WifiPhy()
+    payload = np.random.default_rng(0).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+    start = time.perf_counter()
+    stream = transmit_frames(payload, snr, phy)
+    transmit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    received, missing = receive_frames(stream, phy)
+    receive_time = time.perf_counter() - start
+
+    print(f"{size:,} bytes in {len(fragment(payload))} packets, {len(stream):,} samples at {snr} dB SNR")
+    print("Payload intact:", received == payload, "| missing fragments:", missing)
+    print(f"Transmit {size * 8 / transmit_time / 1e6:.2f} Mbit/s, receive {size * 8 / receive_time / 1e6:.2f} Mbit/s")
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from phy import WifiPhy
+
+# per-process state of a trial worker, filled in once by _init_worker
+_worker = {}
+
+
+def _init_worker(nfft, backend):
+    _worker["phy"] = WifiPhy(nfft, backend)
+
+
+def wilson_interval(errors, trials, z=1.96):
+    # Wilson score interval of an error rate; unlike the normal approximation it stays inside
+    # [0, 1] and is not degenerate at 0 errors, which is where the high-SNR points end up
+    if trials == 0:
+        return 0.0, 1.0
+    rate = errors / trials
+    denominator = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / denominator
+    spread = z * np.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - spread), min(1.0, center + spread)
+
+
+def _chunk_rng(seed, point, chunk):
+    # every (SNR point, chunk) draws from its own stream, so results do not depend on how
+    # chunks are spread over workers or on which chunks a resumed run still has to do
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(point, chunk)))
+
+
+def _run_chunk(task):
+    # trials of one chunk through the level-4 chain; returns the error counts
+    point, chunk, snr, trials, size, seed, decoding = task
+    phy = _worker["phy"]
+    rng = _chunk_rng(seed, point, chunk)
+    payloads = [rng.integers(0, 256, size, dtype=np.uint8).tobytes() for _ in range(trials)]
+    received = [phy.transmit(payload, 4, snr, verbose=False, rng=rng) for payload in payloads]
+    results = phy.receive_batch(received, 4, decoding, raw=True)
+
+    packet_errors = bit_errors = 0
+    for payload, (_, message, _) in zip(payloads, results):
+        packet_errors += message != payload
+        # a payload decoded to the wrong length is compared over the sent bytes, the missing
+        # ones counting as zeros
+        decoded = np.zeros(size, dtype=np.uint8)
+        decoded[:min(size, len(message))] = np.frombuffer(message[:size], dtype=np.uint8)
+        bit_errors += int(np.unpackbits(decoded ^ np.frombuffer(payload, dtype=np.uint8)).sum())
+    return point, chunk, trials, packet_errors, bit_errors
+
+
+def _load_checkpoint(path, config):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        saved = json.load(f)
+    if saved["config"] != config:
+        raise Exception(f"Error: Checkpoint {path} belongs to a sweep with different settings")
+    return saved["points"]
+
+
+def _save_checkpoint(path, config, points):
+    # written to a temporary file and renamed, so an interrupted run never leaves half a file
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump({"config": config, "points": points}, f, indent=2)
+    os.replace(temporary, path)
+
+
+def run_sweep(snrs, trials, size=100, seed=0, decoding='hard', workers=None, chunk_size=50, checkpoint=None, nfft=64, backend='numpy'):
+    # bit and packet error rates of trials random size-byte payloads per SNR, run in chunks on
+    # a process pool. With checkpoint, the counts are saved after every finished chunk and a
+    # rerun with the same settings only does the chunks that are still missing. Returns
+    # {snr: {"packets", "packet_errors", "per", "per_interval", "bits", "bit_errors", "ber", "ber_interval"}}
+    config = {"snrs": [float(snr) for snr in snrs], "trials": trials, "size": size, "seed": seed,
+              "decoding": decoding, "chunk_size": chunk_size, "nfft": nfft, "backend": backend}
+    points = _load_checkpoint(checkpoint, config)
+    for snr in config["snrs"]:
+        points.setdefault(str(snr), {"chunks": [], "packets": 0, "packet_errors": 0, "bits": 0, "bit_errors": 0})
+
+    tasks = []
+    for point, snr in enumerate(config["snrs"]):
+        done = set(points[str(snr)]["chunks"])
+        for chunk, first in enumerate(range(0, trials, chunk_size)):
+            if chunk not in done:
+                tasks.append((point, chunk, snr, min(chunk_size, trials - first), size, seed, decoding))
+
+    if tasks:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(nfft, backend)) as pool:
+            for future in as_completed([pool.submit(_run_chunk, task) for task in tasks]):
+                point, chunk, count, packet_errors, bit_errors = future.result()
+                counts = points[str(config["snrs"][point])]
+                counts["chunks"].append(chunk)
+                counts["packets"] += count
+                counts["packet_errors"] += packet_errors
+                counts["bits"] += count * size * 8
+                counts["bit_errors"] += bit_errors
+                if checkpoint is not None:
+                    _save_checkpoint(checkpoint, config, points)
+
+    results = {}
+    for snr in config["snrs"]:
+        counts = points[str(snr)]
+        results[snr] = {
+            "packets": counts["packets"],
+            "packet_errors": counts["packet_errors"],
+            "per": counts["packet_errors"] / max(counts["packets"], 1),
+            "per_interval": wilson_interval(counts["packet_errors"], counts["packets"]),
+            "bits": counts["bits"],
+            "bit_errors": counts["bit_errors"],
+            "ber": counts["bit_errors"] / max(counts["bits"], 1),
+            # bit errors cluster within packets, so this interval is optimistic about the BER
+            "ber_interval": wilson_interval(counts["bit_errors"], counts["bits"]),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo bit/packet error rates of the level-4 chain against SNR")
+    parser.add_argument("--snrs", type=float, nargs="+", default=[0, 2, 4, 6, 8], help="SNR points in dB")
+    parser.add_argument("--trials", type=int, default=1000, help="packets per SNR point")
+    parser.add_argument("--size", type=int, default=100, help="payload bytes per packet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--decoding", default="hard", choices=["hard", "soft"])
+    parser.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=50, help="packets per task and per checkpoint step")
+    parser.add_argument("--checkpoint", help="JSON file to save progress to and resume from")
+    parser.add_argument("--nfft", type=int, default=64, choices=[64, 128, 256, 512, 1024])
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "commpy"])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_sweep(args.snrs, args.trials, args.size, args.seed, args.decoding, args.workers, args.chunk_size, args.checkpoint, args.nfft, args.backend)
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.trials} packets of {args.size} bytes per point, {args.decoding} decoding, nfft {args.nfft}")
+    for snr, result in results.items():
+        per_low, per_high = result["per_interval"]
+        ber_low, ber_high = result["ber_interval"]
+        print(f"{snr:5.1f} dB: PER {result['per']:.4f} [{per_low:.4f}, {per_high:.4f}], BER {result['ber']:.2e} [{ber_low:.2e}, {ber_high:.2e}]")
+    print(f"{sum(result['packets'] for result in results.values())} packets in {elapsed:.1f} s")
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import inspect
+import sys
+import time
+import numpy as np
+
+# NumPy >= 2.0 can write an FFT straight into a caller-provided array
+_FFT_HAS_OUT = "out" in inspect.signature(np.fft.fft).parameters
+
+
+def _symbol_view(array, nfft):
+    # view the full symbols of (..., N) samples as (..., nsym, nfft) without copying
+    nsym = array.shape[-1] // nfft
+    shape = array.shape[:-1] + (nsym, nfft)
+    strides = array.strides[:-1] + (nfft * array.strides[-1], array.strides[-1])
+    return np.lib.stride_tricks.as_strided(array, shape=shape, strides=strides, writeable=array.flags.writeable)
+
+
+def _transform(fft_func, samples, nfft, out):
+    samples = np.asarray(samples)
+    if out is None:
+        out = np.empty(samples.shape, dtype=np.result_type(samples.dtype, np.complex64))
+
+    # all full symbols go through one batched FFT call; a trailing partial symbol is
+    # passed through untouched, exactly like the per-symbol loops did
+    symbols = _symbol_view(samples, nfft)
+    target = _symbol_view(out, nfft)
+    if _FFT_HAS_OUT and target.dtype == np.complex128:
+        fft_func(symbols, axis=-1, out=target)
+    else:
+        target[...] = fft_func(symbols, axis=-1)
+
+    full = symbols.shape[-2] * nfft
+    out[..., full:] = samples[..., full:]
+    return out
+
+
+def ofdm_modulate(samples, nfft, out=None):
+    # frequency-domain QAM symbols -> time-domain OFDM symbols
+    return _transform(np.fft.ifft, samples, nfft, out)
+
+
+def ofdm_demodulate(samples, nfft, out=None):
+    # time-domain OFDM symbols -> frequency-domain QAM symbols
+    return _transform(np.fft.fft, samples, nfft, out)
+
+
+class OfdmWorkspace:
+    # reuses one output buffer per (shape, dtype), so decoding packets of the same size
+    # does not allocate a new array each time; the returned array is overwritten by the
+    # next call with the same shape, so consume it (or copy it) before then. With a dtype
+    # (complex64 or complex128) every output uses it, whatever the dtype of the input
+    def __init__(self, nfft=64, max_buffers=8, dtype=None):
+        self.nfft = nfft
+        self.max_buffers = max_buffers
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.buffers = {}
+
+    def buffer(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype))
+        if key in self.buffers:
+            self.buffers[key] = self.buffers.pop(key)  # mark as most recently used
+        else:
+            if len(self.buffers) >= self.max_buffers:
+                self.buffers.pop(next(iter(self.buffers)))
+            self.buffers[key] = np.empty(shape, dtype=dtype)
+        return self.buffers[key]
+
+    def modulate(self, samples):
+        samples = np.asarray(samples)
+        return ofdm_modulate(samples, self.nfft, out=self.buffer(samples.shape, self._output_dtype(samples)))
+
+    def demodulate(self, samples):
+        samples = np.asarray(samples)
+        return ofdm_demodulate(samples, self.nfft, out=self.buffer(samples.shape, self._output_dtype(samples)))
+
+    def _output_dtype(self, samples):
+        return self.dtype if self.dtype is not None else np.result_type(samples.dtype, np.complex64)
+
+
+# check against the per-symbol loops of the transmitter/receiver and time both
+if __name__ == "__main__":
+    nfft = 64
+    num_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 80192
+
+    def loop_transform(fft_func, samples):
+        output = samples.copy()
+        nsym = int(len(output) / nfft)
+        for i in range(nsym):
+            output[i * nfft:(i + 1) * nfft] = fft_func(output[i * nfft:(i + 1) * nfft])
+        return output
+
+    rng = np.random.default_rng(0)
+    workspace = OfdmWorkspace(nfft)
+    for length in [nfft, 5 * nfft, 5 * nfft + 17, num_samples]:
+        samples = rng.standard_normal(length) + 1j * rng.standard_normal(length)
+        for name, fft_func, batched in [("ifft", np.fft.ifft, ofdm_modulate), ("fft", np.fft.fft, ofdm_demodulate)]:
+            expected = loop_transform(fft_func, samples)
+            assert np.array_equal(batched(samples, nfft), expected), (name, length)
+            assert np.array_equal(workspace.demodulate(samples) if name == "fft" else workspace.modulate(samples), expected), (name, length)
+
+        # batched rows must match transforming each row on its own
+        rows = np.stack([samples, samples[::-1]])
+        assert np.array_equal(ofdm_demodulate(rows, nfft)[1], loop_transform(np.fft.fft, samples[::-1])), length
+    print("Batched OFDM matches the per-symbol loops")
+
+    samples = rng.standard_normal(num_samples) + 1j * rng.standard_normal(num_samples)
+    repeats = 20
+    start = time.perf_counter()
+    for _ in range(repeats):
+        loop_transform(np.fft.fft, samples)
+    loop_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        workspace.demodulate(samples)
+    batched_time = (time.perf_counter() - start) / repeats
+
+    print(f"Per-symbol loop: {loop_time * 1e3:.2f} ms, batched: {batched_time * 1e3:.2f} ms ({loop_time / batched_time:.1f}x)")
@@ -0,0 +1,638 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import functools
+import numpy as np
+import codec
+from viterbi import build_trellis_tables, hard_vdecoder, quantize_llrs, soft_vdecoder
+from sync import find_first_path, find_start_index
+from ofdm import OfdmWorkspace, ofdm_modulate
+from equalizer import EQUALIZERS, equalize, equalizer_weights, estimate_channel, multipath
+from instrument import NULL_RECORDER
+
+MAX_MESSAGE_LENGTH = 10000
+DECODINGS = ('hard', 'soft')
+BACKENDS = ('numpy', 'commpy')
+NFFT_SIZES = (64, 128, 256, 512, 1024)
+PREAMBLE = np.array([1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1,1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1])
+
+
+class WifiPhy:
+    # holds everything the transmitter/receiver chain needs that does not depend on the
+    # message (interleaver, preamble, trellis, modem), so it is built once per session
+    # instead of once per packet; not thread-safe, use one instance per thread/process.
+    # backend='numpy' uses the QPSK / (0o7, 0o5) codec in codec.py, which is bit-exact with
+    # commpy's; backend='commpy' runs modulation, encoding and the channel through commpy.
+    # dtype is the complex working precision of the receiver (complex64 halves its buffers).
+    # nfft sets the OFDM symbol size; the interleaver, preamble and length field all span one
+    # symbol of 2*nfft bits and are derived from it. equalizer='zf' or 'mmse' makes the
+    # level-4 receiver estimate each packet's channel from its preamble and equalize the
+    # length field and payload with it. recorder (an instrument.StageRecorder) collects
+    # per-stage timings of every transmit and receive
+    def __init__(self, nfft=64, backend='numpy', dtype=np.complex128, equalizer=None, recorder=None):
+        if nfft not in NFFT_SIZES:
+            raise Exception(f"Error: Unsupported nfft, must be one of {NFFT_SIZES}")
+        if backend not in BACKENDS:
+            raise Exception("Error: Unsupported backend, must be 'numpy' or 'commpy'")
+        if np.dtype(dtype) not in (np.complex64, np.complex128):
+            raise Exception("Error: Unsupported dtype, must be complex64 or complex128")
+        if equalizer is not None and equalizer not in EQUALIZERS:
+            raise Exception(f"Error: Unsupported equalizer, must be one of {EQUALIZERS}")
+        self.nfft = nfft
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
+        self.equalizer = equalizer
+        self.recorder = recorder if recorder is not None else NULL_RECORDER
+
+        # interleaver permutation over 2*nfft bits and its inverse (0-based)
+        self.interleave = np.reshape(np.transpose(np.reshape(np.arange(2*nfft), [-1, 4])), [-1,])
+        self.deinterleave = np.zeros_like(self.interleave)
+        self.deinterleave[self.interleave] = np.arange(2*nfft)
+
+        # the 128-bit preamble repeats a 64-bit pattern, which is tiled over larger symbols
+        self.preamble = np.resize(PREAMBLE, 2*nfft)
+        self.ofdm = OfdmWorkspace(nfft, dtype=self.dtype)
+
+    # commpy (which pulls in sympy and matplotlib) is only imported once a property that needs
+    # it is first used, so importing the PHY modules and building a session stay cheap
+
+    @functools.cached_property
+    def trellis(self):
+        # convolutional code of the transmitter
+        if self.backend == 'numpy':
+            return codec.conv_trellis()
+        import commpy.channelcoding.convcode as check
+        return check.Trellis(np.array([3]), np.array([[0o7, 0o5]]))
+
+    @functools.cached_property
+    def trellis_tables(self):
+        # predecessor tables of the trellis for the viterbi decoder
+        return build_trellis_tables(self.trellis)
+
+    @functools.cached_property
+    def modem(self):
+        if self.backend == 'numpy':
+            return codec.QpskModem()
+        import commpy.modulation
+        return commpy.modulation.QAMModem(4)
+
+    @functools.cached_property
+    def preamble_symbols(self):
+        # preamble bits after QAM
+        return self.modulate(self.preamble)
+
+    @functools.cached_property
+    def preamble_time(self):
+        # the preamble after QAM + OFDM, as it appears on the air
+        return ofdm_modulate(self.preamble_symbols, self.nfft)
+
+    def transmit(self, message, level=4, snr=np.inf, verbose=True, rng=None, taps=None):
+        # message is a str (characters 0-255) or an arbitrary bytes payload; verbose=False
+        # silences the level-4 padding report, rng (a np.random.Generator) drives the channel
+        # and taps (complex impulse response) adds multipath to it
+        nfft = self.nfft
+
+        ## Sanity checks
+        if len(message) > MAX_MESSAGE_LENGTH:
+            raise Exception("Error: Message is too long")
+        if level>4 or level<1:
+            raise Exception("Error:Invalid Level, must be 1-4")
+
+        recorder = self.recorder
+        if level >= 1:
+            # repetition-coded length field followed by the interleaved payload bits
+            with recorder.stage("interleave", 8 * len(message)):
+                output = self.level1_encode(message)
+
+        if level >= 2:
+            with recorder.stage("conv_encode", len(output)):
+                coded_message = self.conv_encode(output[2*nfft:])
+                output = np.concatenate((output[:2*nfft],coded_message))
+                output = np.concatenate((self.preamble, output))
+            with recorder.stage("modulate", len(output)):
+                output = self.modulate(output)
+
+        if level >= 3:
+            with recorder.stage("ofdm_modulate", len(output)):
+                output = ofdm_modulate(output, nfft)
+
+        if level >= 4:
+            with recorder.stage("channel", len(output)):
+                output, noise_pad_begin_length, noise_pad_end_length = self.channel(output, snr, rng, taps)
+            if verbose:
+                print("Noise Padding Begin Length:", noise_pad_begin_length)
+                print("Noise Padding End Length:", noise_pad_end_length)
+                print("Output Length:", len(output))
+
+        return output
+
+    def channel(self, samples, snr=np.inf, rng=None, taps=None):
+        # level-4 channel: the samples through the multipath taps (if any), random zero padding
+        # on both ends, then AWGN over the whole stream; without rng the padding and noise come
+        # from the global np.random state
+        if taps is not None:
+            samples = multipath(samples, taps)
+        if rng is None:
+            noise_pad_begin = np.zeros(np.random.randint(1,1000))
+            noise_pad_end = np.zeros(np.random.randint(1,1000))
+        else:
+            noise_pad_begin = np.zeros(rng.integers(1,1000))
+            noise_pad_end = np.zeros(rng.integers(1,1000))
+        output = np.concatenate((noise_pad_begin,samples,noise_pad_end))
+        output = self.awgn(output,snr,rng)
+        return output, len(noise_pad_begin), len(noise_pad_end)
+
+    def receive(self, input_stream, level, decoding='hard', raw=False):
+        # returns (begin_zero_padding, message, length); message is bytes if raw, else a str.
+        # input_stream is only read, never written: level 4 keeps slicing views of it, the
+        # FFT of level 3 goes into the workspace buffer for this packet size (reused across
+        # packets, in self.dtype), so the per-packet allocations are the preamble search,
+        # the demodulated bits (or LLRs), the viterbi tables and the decoded payload
+        nfft = self.nfft
+        _check_decoding(decoding)
+
+        # set zero padding to be 0, by default
+        begin_zero_padding = 0
+        message = ""
+        length = 0
+        weights = None
+        recorder = self.recorder
+
+        if level >= 4:
+            #Input QAM modulated + Encoded Bits + OFDM Symbols in a long stream
+            #Output Detected Packet set of symbols
+
+            with recorder.stage("sync", len(input_stream)):
+                # remove initial padding, using the precomputed on-air preamble
+                begin_zero_padding = self.find_start(input_stream)
+                weights = self.channel_weights(input_stream[None, begin_zero_padding:begin_zero_padding + len(self.preamble_time)])
+                input_stream = input_stream[begin_zero_padding + len(self.preamble_time):]
+
+                # only decode as far as the length field says the packet goes, not the end padding
+                input_stream = input_stream[:self.packet_span(input_stream[None, :nfft], decoding, weights)[0]]
+
+        if level >= 3:
+            #Input QAM modulated + Encoded Bits + OFDM Symbols
+            #Output QAM modulated + Encoded Bits
+
+            # use FFT to switch to frequency domain, all symbols at once
+            with recorder.stage("ofdm_demodulate", len(input_stream)):
+                input_stream = self.ofdm.demodulate(input_stream)
+                if weights is not None:
+                    equalize(input_stream[None, :], weights)
+
+        if level >= 2:
+            #Input QAM modulated + Encoded Bits
+            #Output Interleaved bits + Encoded Length
+
+            # demodulate the stream, to bits or to per-bit LLRs for soft decoding
+            with recorder.stage("demodulate", len(input_stream)):
+                demod = self.demodulate_soft(input_stream) if decoding == 'soft' else self.demodulate_hard(input_stream)
+
+            # preamble is already removed from the stream in level 4
+            if level <= 3:
+                demod = demod[len(self.preamble):]
+
+            # split into encoded length and message
+            encoded_length = demod[:2*nfft]
+            message = demod[2*nfft:]
+
+            # viterbi decode to get interleaved bits (which are handled by level 1)
+            with recorder.stage("viterbi", len(message)):
+                if decoding == 'soft':
+                    encoded_length = self.soft_length_bits(encoded_length)
+                    decoded_bits = soft_vdecoder(quantize_llrs(message), self.trellis_tables)
+                else:
+                    decoded_bits = hard_vdecoder(message, self.trellis_tables)
+
+            # level 1 reads encoded_length and decoded_bits as they are, without joining them
+
+        if level >= 1:
+            #Input Interleaved bits + Encoded Length
+            #Output Deinterleaved bits
+
+            if level == 1:
+                input_stream = np.asarray(input_stream)
+                encoded_length, decoded_bits = input_stream[:2*nfft], input_stream[2*nfft:]
+
+            # majority-voted length, deinterleaved payload bits packed back into bytes
+            with recorder.stage("deinterleave", len(decoded_bits)):
+                payloads, lengths = self.level1_decode(encoded_length[None, :], decoded_bits[None, :])
+            message = payloads[0] if raw else payloads[0].decode('latin-1')
+            length = int(lengths[0])
+
+            return begin_zero_padding, message, length
+
+        raise Exception("Error: Unsupported level")
+
+    def transmit_batch(self, messages, level=3, out=None, gap=0):
+        # level-2/3 packets of many messages written back to back (with gap zero samples after
+        # each) into one output buffer, which is allocated if out is None and must otherwise
+        # hold packet_samples of every message plus the gaps; messages of equal length are
+        # encoded, modulated and OFDM-transformed together. Returns (out, packet offsets)
+        if level not in (2, 3):
+            raise Exception("Error: Batch transmit produces level 2 or 3 samples")
+        payloads = [message.encode('latin-1') if isinstance(message, str) else bytes(message) for message in messages]
+        if any(len(payload) > MAX_MESSAGE_LENGTH for payload in payloads):
+            raise Exception("Error: Message is too long")
+
+        sizes = np.array([self.packet_samples(len(payload)) for payload in payloads], dtype=np.int64)
+        offsets = np.cumsum(sizes + gap) - sizes - gap  # one per message, none for no messages
+        total = int(np.sum(sizes + gap))
+        if out is None:
+            out = np.zeros(total, dtype=self.dtype)
+        elif len(out) < total:
+            raise Exception(f"Error: Output buffer holds {len(out)} samples, {total} needed")
+        elif gap:
+            out[:total] = 0
+
+        groups = {}
+        for index, payload in enumerate(payloads):
+            groups.setdefault(len(payload), []).append(index)
+        recorder = self.recorder
+        for indices in groups.values():
+            with recorder.stage("interleave", 8 * len(payloads[indices[0]]) * len(indices)):
+                bits = np.stack([self.level1_encode(payloads[i]) for i in indices])
+            with recorder.stage("conv_encode", bits.size):
+                coded = self.conv_encode(bits[:, 2*self.nfft:])
+                stream = np.concatenate((np.broadcast_to(self.preamble, (len(indices), 2*self.nfft)), bits[:, :2*self.nfft], coded), axis=1)
+            with recorder.stage("modulate", stream.size):
+                symbols = self.modulate(stream)
+            if level >= 3:
+                with recorder.stage("ofdm_modulate", symbols.size):
+                    symbols = self.ofdm.modulate(symbols)
+            for row, i in zip(symbols, indices):
+                out[offsets[i]:offsets[i] + sizes[i]] = row
+        return out, offsets
+
+    def packet_samples(self, length):
+        # level-2/3 samples of a packet: preamble and length field symbols, then the payload
+        return 2*self.nfft + self.payload_bits(length)
+
+    def modulate(self, bits):
+        # QAM symbols of the bits in the last axis of any (..., 2*nsym) array
+        if self.backend == 'numpy':
+            return codec.qpsk_modulate(bits)
+        bits = np.asarray(bits)
+        symbols = self.modem.modulate(bits.reshape(-1).astype(bool))
+        return symbols.reshape(bits.shape[:-1] + (-1,))
+
+    def conv_encode(self, bits):
+        # encoded bits without the termination tail, over the last axis of any (..., nbits) array
+        if self.backend == 'numpy':
+            return codec.conv_encode(bits)
+        from commpy.channelcoding.convcode import conv_encode
+        bits = np.asarray(bits)
+        if bits.ndim > 1:
+            return np.stack([self.conv_encode(row) for row in bits.reshape(-1, bits.shape[-1])]).reshape(bits.shape[:-1] + (-1,))
+        return conv_encode(bits.astype(bool), self.trellis)[:-6]
+
+    def awgn(self, samples, snr, rng=None):
+        # commpy's awgn only draws from np.random, so a generator always uses the numpy version
+        if self.backend == 'numpy' or rng is not None:
+            return codec.awgn(samples, snr, rng=rng)
+        from commpy.channels import awgn
+        return awgn(samples, snr)
+
+    def demodulate_hard(self, symbols):
+        # same nearest-point decision as QAMModem.demodulate(..., 'hard'), but broadcast over
+        # any (..., nsym) array and unpacked to bits with shifts instead of a per-symbol loop
+        if self.backend == 'numpy':
+            return codec.qpsk_demodulate_hard(symbols)
+        constellation = self.modem.constellation
+        num_bits = self.modem.num_bits_symbol
+        index = np.abs(np.asarray(symbols)[..., None] - constellation).argmin(axis=-1)
+        bits = (index[..., None] >> np.arange(num_bits - 1, -1, -1)) & 1
+        return bits.reshape(bits.shape[:-2] + (-1,))
+
+    def demodulate_soft(self, symbols):
+        # max-log LLR of every bit (positive favours a 1, like QAMModem.demodulate(..., 'soft')),
+        # broadcast over any (..., nsym) array; the noise variance only scales the LLRs, and the
+        # viterbi decoder re-scales them when quantizing, so it is not needed here
+        if self.backend == 'numpy':
+            return codec.qpsk_demodulate_soft(symbols)
+        constellation = self.modem.constellation
+        num_bits = self.modem.num_bits_symbol
+        distances = np.abs(np.asarray(symbols)[..., None] - constellation) ** 2
+        ones = ((np.arange(len(constellation))[:, None] >> np.arange(num_bits - 1, -1, -1)) & 1).astype(bool)
+        nearest_one = np.where(ones, distances[..., None], np.inf).min(axis=-2)
+        nearest_zero = np.where(ones, np.inf, distances[..., None]).min(axis=-2)
+        llrs = nearest_zero - nearest_one
+        return llrs.reshape(llrs.shape[:-2] + (-1,))
+
+    def soft_length_bits(self, length_llrs):
+        # soft decision on the repetition-coded length field: the legal length field that
+        # correlates best with the LLRs, returned as bits so decode_length reads it unchanged.
+        # The copies of a length bit line up from the right, so the LLRs are summed per group of
+        # three; the zero fill and the groups above the widest legal length add the same to
+        # every candidate's score and are left out
+        # (a field cut short by the end of the stream scores on the LLRs it has)
+        length_llrs = np.asarray(length_llrs)
+        width = min(length_llrs.shape[-1], 2*self.nfft)
+        field = np.zeros(length_llrs.shape[:-1] + (2*self.nfft,), dtype=np.float32)
+        field[..., :width] = length_llrs[..., :width]
+        signs = self.length_signs
+        groups = field[..., 2*self.nfft - 3*len(signs):].reshape(field.shape[:-1] + (len(signs), 3)).sum(axis=-1)
+        return self.encode_length((groups @ signs).argmax(axis=-1))
+
+    @functools.cached_property
+    def length_signs(self):
+        # (bits, MAX_MESSAGE_LENGTH + 1) float32 matrix of the low length bits of every legal
+        # length as +-1, the same for every nfft
+        bits = MAX_MESSAGE_LENGTH.bit_length()
+        lengths = np.arange(MAX_MESSAGE_LENGTH + 1)
+        return (2 * ((lengths >> np.arange(bits - 1, -1, -1)[:, None]) & 1) - 1).astype(np.float32)
+
+    def level1_encode(self, message):
+        # level-1 transmitter on uint8 arrays: the length field, then the payload bits padded to
+        # whole 2*nfft-bit symbols and interleaved by one fancy index over all symbols at once
+        payload = message.encode('latin-1') if isinstance(message, str) else bytes(message)
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+        output = np.zeros(2*self.nfft + int(self.payload_bits(len(payload))), dtype=np.uint8)
+        output[:2*self.nfft] = self.encode_length(len(payload))
+        padded = np.zeros(len(output) - 2*self.nfft, dtype=np.uint8)
+        padded[:len(bits)] = bits
+        output[2*self.nfft:] = padded.reshape(-1, 2*self.nfft)[:, self.interleave].reshape(-1)
+        return output
+
+    def level1_decode(self, encoded_length, chunks):
+        # level-1 receiver on the (batch, 2*nfft) length fields and (batch, bits) interleaved
+        # payloads of equal-length streams: majority-voted lengths and deinterleaved payloads as
+        # bytes (bits past the last whole symbol are zeros). Only whole symbols are deinterleaved,
+        # by one fancy index straight into a uint8 array
+        nfft = self.nfft
+        chunks = np.asarray(chunks)
+        lengths = self.decode_length(encoded_length)
+        batch, num_bits = chunks.shape
+        full = num_bits // (2*nfft) * (2*nfft)
+        symbols = chunks[:, :full].reshape(batch, -1, 2*nfft)
+        deinterleaved = np.take(symbols, self.deinterleave, axis=2).astype(np.uint8, copy=False).reshape(batch, -1)
+        if full < num_bits:
+            deinterleaved = np.pad(deinterleaved, [(0, 0), (0, num_bits - full)])
+        payloads = [np.packbits(bits[:length * 8]).tobytes() for bits, length in zip(deinterleaved, lengths)]
+        return payloads, lengths
+
+    def encode_length(self, length):
+        # repetition-coded length field of one length or an array of them: each bit of the
+        # binary length sent three times, zero-filled on the left to 2*nfft bits; leading zero
+        # bits repeat to zeros, so a fixed-width binary gives the same field as np.binary_repr
+        width = 2*self.nfft // 3
+        bits = (np.asarray(length, dtype=np.int64)[..., None] >> np.arange(width - 1, -1, -1)) & 1
+        field = np.repeat(bits.astype(np.uint8), 3, axis=-1)
+        pad = [(0, 0)] * (field.ndim - 1) + [(2*self.nfft - 3*width, 0)]
+        return np.pad(field, pad)
+
+    def decode_length(self, encoded_length):
+        # majority vote over the three copies of each length bit, for one field or a (batch, 2*nfft)
+        # array of them; the zero fill on the left is skipped so the groups line up with the copies
+        # whatever 2*nfft is modulo 3
+        encoded_length = np.asarray(encoded_length).astype(np.int8)
+        num_groups = encoded_length.shape[-1] // 3
+        groups = encoded_length[..., encoded_length.shape[-1] - 3 * num_groups:].reshape(encoded_length.shape[:-1] + (num_groups, 3))
+        votes = (groups.sum(axis=-1) >= 2).astype(np.int64)
+        # fields wider than 48 bits (nfft 128 and up) saturate at 2**48 instead of overflowing;
+        # any length that large is garbage and rejected by the callers' range checks either way
+        low = min(num_groups, 48)
+        lengths = votes[..., num_groups - low:] @ (1 << np.arange(low - 1, -1, -1, dtype=np.int64))
+        return np.where(votes[..., :num_groups - low].any(axis=-1), 1 << 48, lengths)
+
+    def payload_bits(self, length):
+        # interleaved message bits for a length-character message (always padded by 1..2*nfft bits)
+        return (np.asarray(length) * 8 // (2*self.nfft) + 1) * 2*self.nfft
+
+    def packet_span(self, length_symbols, decoding='hard', weights=None):
+        # on-air samples after the preamble (length field + payload) of the packets whose length
+        # field OFDM symbols are given as a (batch, nfft) array, equalized by the (batch, nfft)
+        # weights if given; rate-1/2 coding and 2 bits per QAM symbol make the payload exactly
+        # payload_bits samples long
+        length_symbols = np.asarray(length_symbols)
+        if length_symbols.shape[-1] < self.nfft:
+            return np.zeros(len(length_symbols), dtype=np.int64)
+        length_symbols = np.fft.fft(length_symbols, axis=-1)
+        if weights is not None:
+            length_symbols *= weights
+        lengths = self.decode_length(self.length_bits(length_symbols, decoding))
+        return self.packet_span_for_length(lengths)
+
+    @contextlib.contextmanager
+    def recording(self, recorder):
+        # attach recorder for the calls made inside the with block (None leaves it as it is)
+        previous = self.recorder
+        if recorder is not None:
+            self.recorder = recorder
+        try:
+            yield self
+        finally:
+            self.recorder = previous
+
+    def find_start(self, signal):
+        # preamble start of one stream or a (batch, samples) array; an equalizing session
+        # expects multipath and looks for the first strong path instead of an exact match
+        if self.equalizer is None:
+            return find_start_index(signal, self.preamble_time)
+        return find_first_path(signal, self.preamble_time, self.nfft // 4)
+
+    def channel_weights(self, preamble_samples):
+        # (batch, nfft) equalizer weights from the received time-domain preambles, or None
+        # when the session does not equalize
+        if self.equalizer is None:
+            return None
+        channel, noise_var = estimate_channel(preamble_samples, self.preamble_symbols)
+        return equalizer_weights(channel, noise_var, self.equalizer)
+
+    def length_bits(self, length_symbols, decoding='hard'):
+        # bits of the length field from its QAM symbols, decided from their LLRs if soft
+        if decoding == 'soft':
+            return self.soft_length_bits(self.demodulate_soft(length_symbols))
+        return self.demodulate_hard(length_symbols)
+
+    def packet_span_for_length(self, length):
+        return self.nfft + self.payload_bits(length)
+
+    def receive_batch(self, input_streams, level, decoding='hard', raw=False):
+        # decode many packets of one level in one call; packets spanning the same number of
+        # samples are stacked and go through OFDM, demodulation, viterbi and level 1 together
+        if level>4 or level<1:
+            raise Exception("Error: Unsupported level")
+        _check_decoding(decoding)
+        nfft = self.nfft
+        streams = [np.asarray(stream) for stream in input_streams]
+        begin_zero_padding = np.zeros(len(streams), dtype=np.int64)
+        if not streams:
+            return []
+
+        if level >= 4:
+            # detect every preamble with one batched correlation over the zero-padded streams,
+            # then read each length field to cut the packet out of its padding
+            # (the search covers nfft samples past the longest stream; the preamble and length
+            # field read after a start found there are zeros)
+            with self.recorder.stage("sync", sum(len(stream) for stream in streams)):
+                stacked = _stack(streams, nfft + len(self.preamble_time) + nfft)
+                begin_zero_padding = np.atleast_1d(self.find_start(stacked[:, :stacked.shape[1] - len(self.preamble_time) - nfft]))
+                starts = begin_zero_padding + len(self.preamble_time)
+                rows = np.arange(len(streams))[:, None]
+                weights = self.channel_weights(stacked[rows, begin_zero_padding[:, None] + np.arange(len(self.preamble_time))])
+                length_symbols = stacked[rows, starts[:, None] + np.arange(nfft)]
+                spans = self.packet_span(length_symbols, decoding, weights)
+                streams = [stream[start:start + span] for stream, start, span in zip(streams, starts, spans)]
+            return self._decode_segments(streams, level, begin_zero_padding, decoding, raw, weights)
+
+        return self._decode_segments(streams, level, begin_zero_padding, decoding, raw)
+
+    def receive_at(self, samples, starts, decoding='hard', raw=False):
+        # decode the level-4 packets whose preambles begin at the given offsets of one long
+        # capture (e.g. from find_packet_starts), each cut to the span its length field announces
+        nfft = self.nfft
+        _check_decoding(decoding)
+        starts = np.asarray(starts, dtype=np.int64)
+        if not len(starts):
+            return []
+        with self.recorder.stage("sync", len(starts) * (len(self.preamble_time) + nfft)):
+            # preamble and length field symbols of every packet, zero-filled past the capture's end
+            heads = np.zeros((len(starts), len(self.preamble_time) + nfft), dtype=complex)
+            for row, start in zip(heads, starts):
+                head = samples[start:start + heads.shape[1]]
+                row[:len(head)] = head
+            weights = self.channel_weights(heads[:, :len(self.preamble_time)])
+            spans = self.packet_span(heads[:, len(self.preamble_time):], decoding, weights)
+            segments = [samples[start:start + span] for start, span in zip(starts + len(self.preamble_time), spans)]
+        return self._decode_segments(segments, 4, starts, decoding, raw, weights)
+
+    def _decode_segments(self, segments, level, offsets, decoding='hard', raw=False, weights=None):
+        # segments with the same number of samples are stacked and decoded as one array
+        groups = {}
+        for index, segment in enumerate(segments):
+            groups.setdefault(len(segment), []).append(index)
+
+        results = [None] * len(segments)
+        for indices in groups.values():
+            group_weights = weights[indices] if weights is not None else None
+            payloads, lengths = self._decode_rows(np.stack([segments[i] for i in indices]), level, decoding, group_weights)
+            for i, payload, length in zip(indices, payloads, lengths):
+                results[i] = (int(offsets[i]), payload if raw else payload.decode('latin-1'), int(length))
+
+        return results
+
+    def _decode_rows(self, rows, level, decoding='hard', weights=None):
+        # levels 3..1 of the receiver on a (batch, samples) array of equal-length packets,
+        # equalized by the (batch, nfft) weights of their preambles if given
+        nfft = self.nfft
+        recorder = self.recorder
+
+        if level >= 3:
+            with recorder.stage("ofdm_demodulate", rows.size):
+                rows = self.ofdm.demodulate(rows)
+                if weights is not None:
+                    equalize(rows, weights)
+
+        if level >= 2:
+            with recorder.stage("demodulate", rows.size):
+                demod = self.demodulate_soft(rows) if decoding == 'soft' else self.demodulate_hard(rows)
+            if level <= 3:
+                demod = demod[:, len(self.preamble):]
+            with recorder.stage("viterbi", demod[:, 2*nfft:].size):
+                if decoding == 'soft':
+                    encoded_length = self.soft_length_bits(demod[:, :2*nfft])
+                    decoded_bits = soft_vdecoder(quantize_llrs(demod[:, 2*nfft:]), self.trellis_tables)
+                else:
+                    encoded_length = demod[:, :2*nfft]
+                    decoded_bits = hard_vdecoder(demod[:, 2*nfft:], self.trellis_tables)
+        else:
+            encoded_length, decoded_bits = rows[:, :2*nfft], rows[:, 2*nfft:]
+
+        with recorder.stage("deinterleave", decoded_bits.size):
+            return self.level1_decode(encoded_length, decoded_bits)
+
+
+def _check_decoding(decoding):
+    if decoding not in DECODINGS:
+        raise Exception("Error: Unsupported decoding, must be 'hard' or 'soft'")
+
+
+def _stack(streams, extra):
+    # zero-padded (batch, longest + extra) copy of a list of 1-D streams
+    width = max([len(stream) for stream in streams] + [0]) + extra
+    stacked = np.zeros((len(streams), width), dtype=np.result_type(complex, *streams))
+    for row, stream in zip(stacked, streams):
+        row[:len(stream)] = stream
+    return stacked
+
+
+@functools.lru_cache(maxsize=None)
+def shared_phy(nfft=64, backend='numpy'):
+    # process-wide session per symbol size used by WifiTransmitter/WifiReceiver
+    return WifiPhy(nfft, backend)
+
+
+# round trip at every level and compare per-packet cost with and without a reused session
+if __name__ == "__main__":
+    import io
+    import sys
+    import time
+
+    message = sys.argv[1] if len(sys.argv) > 1 else "hello world"
+    phy = WifiPhy()
+    for level in range(1, 5):
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = phy.transmit(message, level, 20)
+        print(f"Level {level} round trip:", phy.receive(output, level)[1] == message)
+
+    repeats = 200
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            WifiPhy().receive(output, 4)
+        fresh_time = (time.perf_counter() - start) / repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            phy.receive(output, 4)
+        shared_time = (time.perf_counter() - start) / repeats
+
+    print(f"Level 4 receive: {1 / fresh_time:,.0f} packets/sec rebuilding the session, {1 / shared_time:,.0f} packets/sec reusing it")
+
+    # batch decode of equal-size packets against the one-packet-at-a-time receiver
+    num_packets = 256
+    with contextlib.redirect_stdout(io.StringIO()):
+        outputs = [phy.transmit(message, 4, 10) for _ in range(num_packets)]
+
+    start = time.perf_counter()
+    single = [phy.receive(output, 4) for output in outputs]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = phy.receive_batch(outputs, 4)
+    batch_time = time.perf_counter() - start
+
+    print("Batch matches single-packet decode:", batch == single)
+    print(f"Level 4 x{num_packets}: {num_packets / single_time:,.0f} packets/sec one by one, {num_packets / batch_time:,.0f} packets/sec with receive_batch")
+
+    # a noise-only or short stream in a batch syncs somewhere in the padding and decodes to
+    # nothing useful, but must not break the other packets of the batch
+    rng = np.random.default_rng(0)
+    noise = rng.standard_normal(300) + 1j * rng.standard_normal(300)
+    mixed = phy.receive_batch([outputs[0], noise, noise[:10]], 4)
+    print("Batch with noise-only streams keeps its packets:", mixed[0] == single[0])
+
+    # soft decoding of a stream too short for a length field after the sync point
+    print("Soft decode of short noise-only streams:", all(isinstance(phy.receive(noise[:n], 4, 'soft')[1], str) for n in (10, 150, 300)))
+
+    # an empty batch is no packets, not a reshape of zero rows
+    print("Empty batch decodes to nothing:", all(phy.receive_batch([], level, decoding) == [] for level in (1, 2, 3, 4) for decoding in ('hard', 'soft')))
+    print("No starts decode to nothing:", all(phy.receive_at(outputs[0], [], decoding) == [] for decoding in ('hard', 'soft')))
+    print("Empty transmit_batch has no offsets:", len(phy.transmit_batch([])[1]) == 0)
+
+    # receive cost against the OFDM symbol size, on packets built by the batch transmitter
+    payload = "".join(chr(c) for c in np.random.default_rng(0).integers(32, 127, 1000))
+    for nfft in NFFT_SIZES:
+        sized = WifiPhy(nfft)
+        start = time.perf_counter()
+        samples, offsets = sized.transmit_batch([payload] * num_packets, 3)
+        transmit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        received = sized.receive_at(samples, offsets)
+        receive_time = time.perf_counter() - start
+
+        correct = sum(result[1] == payload for result in received)
+        print(f"nfft {nfft:4}: {correct}/{num_packets} decoded, transmit_batch {num_packets / transmit_time:,.0f} packets/sec, "
+              f"receive {num_packets / receive_time:,.0f} packets/sec ({num_packets * len(payload) * 8 / receive_time / 1e6:.2f} Mbit/s)")
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# command line front end: python -m phycli transmit|receive ...
+# only argparse is imported up front, each command imports the PHY modules it needs
+import argparse
+import sys
+
+
+def transmit_file(args):
+    from capture import CaptureWriter
+    from framing import MAX_FRAGMENT_SIZE, fragment
+    from phy import WifiPhy
+
+    with open(args.input, "rb") as f:
+        payload = f.read()
+    phy = WifiPhy(args.nfft, backend=args.backend, recorder=_recorder(args))
+    packets = fragment(payload, args.fragment_size or MAX_FRAGMENT_SIZE)
+    with CaptureWriter(args.output, args.level, args.snr, phy=phy) as writer:
+        for packet in packets:
+            writer.write_packet(packet)
+    print(f"{len(payload)} bytes -> {len(packets)} packets, {writer.num_samples} samples in {args.output}")
+    _save_profile(args, phy)
+
+
+def receive_file(args):
+    from capture import read_capture
+    from framing import Reassembler, receive_frames
+    from phy import WifiPhy
+
+    capture = read_capture(args.input)
+    phy = WifiPhy(capture.nfft, backend=args.backend, recorder=_recorder(args))
+    if capture.level >= 4:
+        # noisy captures: find the packets the same way a live receiver would
+        payload, missing = receive_frames(capture.samples, phy, decoding=args.decoding)
+    else:
+        # level 2/3 packets sit back to back at the recorded offsets
+        reassembler = Reassembler()
+        bounds = list(capture.offsets) + [len(capture.samples)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            reassembler.add(phy.receive(capture.samples[start:end], capture.level, args.decoding, raw=True)[1])
+        payload, missing = reassembler.payload(), reassembler.missing()
+
+    if payload is None:
+        raise Exception(f"Error: Could not reassemble the payload, missing fragments: {missing}")
+    with open(args.output, "wb") as f:
+        f.write(payload)
+    print(f"{len(payload)} bytes written to {args.output}")
+    _save_profile(args, phy)
+
+
+def _recorder(args):
+    if not args.profile:
+        return None
+    from instrument import StageRecorder
+    return StageRecorder()
+
+
+def _save_profile(args, phy):
+    # per-stage timings as JSON, or as a pstats file for paths ending in .prof/.pstats
+    if args.profile:
+        phy.recorder.save(args.profile)
+        print(phy.recorder.report())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="phycli", description="Send files through the WiFi PHY simulation")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "commpy"], help="modulation/encoding/channel implementation")
+    parser.add_argument("--profile", help="write per-stage timings to this file (JSON, or pstats for .prof/.pstats)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    transmit = commands.add_parser("transmit", help="modulate a file into a capture file")
+    transmit.add_argument("input", help="file to send")
+    transmit.add_argument("output", help="capture file to write")
+    transmit.add_argument("--level", type=int, default=4, choices=[2, 3, 4])
+    transmit.add_argument("--snr", type=float, default=float("inf"), help="channel SNR in dB (level 4)")
+    transmit.add_argument("--nfft", type=int, default=64, choices=[64, 128, 256, 512, 1024], help="OFDM symbol size, recorded in the capture")
+    transmit.add_argument("--fragment-size", type=int, help="payload bytes per packet (default: as many as fit)")
+    transmit.set_defaults(func=transmit_file)
+
+    receive = commands.add_parser("receive", help="decode a capture file back into a file")
+    receive.add_argument("input", help="capture file to read")
+    receive.add_argument("output", help="file to write")
+    receive.add_argument("--decoding", default="hard", choices=["hard", "soft"])
+    receive.set_defaults(func=receive_file)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
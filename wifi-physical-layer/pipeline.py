@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from capture import read_capture
+from phy import WifiPhy
+from sync import find_packet_starts
+
+# per-process state of a decode worker, filled in once by _init_worker
+_worker = {}
+
+
+def _init_worker(shm_name, shape, dtype, nfft):
+    # attach to the parent's shared capture instead of receiving samples with every task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["samples"] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker["phy"] = WifiPhy(nfft)
+
+
+def _init_file_worker(path, nfft):
+    # a capture file is already shared through the page cache, each worker maps it itself
+    capture = read_capture(path)
+    _worker["samples"] = capture.samples
+    _worker["level"] = capture.level
+    _worker["phy"] = WifiPhy(nfft)
+
+
+def _decode_chunk(starts):
+    # only the preamble offsets travel to the worker; it slices the packets out of shared memory
+    start = time.perf_counter()
+    results = _worker["phy"].receive_at(_worker["samples"], starts)
+    return results, time.perf_counter() - start, os.getpid()
+
+
+def _decode_bounds(bounds):
+    # level 2/3 packets have no length field to cut them by, each is received from its own slice
+    start = time.perf_counter()
+    phy, samples, level = _worker["phy"], _worker["samples"], _worker["level"]
+    results = [(begin,) + tuple(phy.receive(samples[begin:end], level)[1:]) for begin, end in bounds]
+    return results, time.perf_counter() - start, os.getpid()
+
+
+def decode_capture(capture, workers=None, chunk_size=32, threshold=0.6, nfft=64):
+    # split a level-4 capture at its detected preambles, decode the packets on a process pool
+    # and return ([(offset, message, length), ...] in capture order, per-stage timings);
+    # capture may also be the path of a capture file, which is memory-mapped instead of copied
+    # and decoded with the level and nfft recorded in its header
+    if isinstance(capture, (str, os.PathLike)):
+        return _decode_capture_file(capture, workers, chunk_size, threshold)
+    capture = np.asarray(capture)
+    timings = {}
+
+    start = time.perf_counter()
+    phy = WifiPhy(nfft)
+    starts = find_packet_starts(capture, phy.preamble_time, threshold)
+    timings["detect"] = time.perf_counter() - start
+    chunks = [starts[i:i + chunk_size] for i in range(0, len(starts), chunk_size)]
+
+    # one copy of the samples into shared memory, visible to every worker without pickling
+    start = time.perf_counter()
+    shm = shared_memory.SharedMemory(create=True, size=max(capture.nbytes, 1))
+    try:
+        np.ndarray(capture.shape, dtype=capture.dtype, buffer=shm.buf)[:] = capture
+        timings["share"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = []
+        worker_time = 0
+        worker_pids = set()
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shm.name, capture.shape, capture.dtype.str, nfft)) as pool:
+            for chunk_results, chunk_time, pid in pool.map(_decode_chunk, chunks):
+                results.extend(chunk_results)
+                worker_time += chunk_time
+                worker_pids.add(pid)
+        timings["decode"] = time.perf_counter() - start
+        timings["worker_busy"] = worker_time
+        timings["workers"] = len(worker_pids)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    timings["total"] = timings["detect"] + timings["share"] + timings["decode"]
+    return results, timings
+
+
+def _decode_capture_file(path, workers, chunk_size, threshold):
+    # the recorded packet offsets replace detection, so the samples are only paged in by the
+    # workers that decode them; level-4 files without offsets are still searched for preambles,
+    # level 2/3 packets sit back to back at their offsets and are received slice by slice
+    timings = {}
+    start = time.perf_counter()
+    capture = read_capture(path)
+    nfft = capture.nfft
+    starts = capture.offsets
+    if capture.level >= 4:
+        if not len(starts) and len(capture.samples):
+            starts = find_packet_starts(capture.samples, WifiPhy(nfft).preamble_time, threshold)
+        decode = _decode_chunk
+    else:
+        if len(capture.samples) and not len(starts):
+            raise Exception(f"Error: Level {capture.level} capture has no packet offsets to split it at")
+        bounds = [int(offset) for offset in starts] + [len(capture.samples)]
+        starts = list(zip(bounds[:-1], bounds[1:]))
+        decode = _decode_bounds
+    timings["detect"] = time.perf_counter() - start
+    timings["share"] = 0.0
+    chunks = [starts[i:i + chunk_size] for i in range(0, len(starts), chunk_size)]
+
+    start = time.perf_counter()
+    results = []
+    worker_time = 0
+    worker_pids = set()
+    with ProcessPoolExecutor(workers, initializer=_init_file_worker, initargs=(os.fspath(path), nfft)) as pool:
+        for chunk_results, chunk_time, pid in pool.map(decode, chunks):
+            results.extend(chunk_results)
+            worker_time += chunk_time
+            worker_pids.add(pid)
+    timings["decode"] = time.perf_counter() - start
+    timings["worker_busy"] = worker_time
+    timings["workers"] = len(worker_pids)
+
+    timings["total"] = timings["detect"] + timings["share"] + timings["decode"]
+    return results, timings
+
+
+# decode a synthetic capture of back-to-back packets with an increasing number of workers
+if __name__ == "__main__":
+    import contextlib
+    import io
+
+    num_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    phy = WifiPhy()
+    rng = np.random.default_rng(0)
+    messages = ["".join(chr(c) for c in rng.integers(32, 127, 200)) for _ in range(num_packets)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        capture = np.concatenate([phy.transmit(message, 4, 15) for message in messages])
+    print(f"Capture: {num_packets} packets, {len(capture):,} samples")
+
+    workers = 1
+    while workers <= max_workers:
+        results, timings = decode_capture(capture, workers)
+        correct = sum(result[1] == message for result, message in zip(results, messages))
+        stages = ", ".join(f"{stage} {seconds * 1e3:.0f} ms" for stage, seconds in timings.items() if stage != "workers")
+        print(f"{workers} worker(s): {correct}/{num_packets} decoded, {len(results) / timings['total']:,.0f} packets/sec ({stages})")
+        workers *= 2
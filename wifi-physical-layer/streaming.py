@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import sys
+import numpy as np
+from phy import MAX_MESSAGE_LENGTH, WifiPhy
+from sync import find_packet_starts
+from equalizer import equalize
+from viterbi import WindowedViterbi, quantize_llrs
+
+
+class StreamingReceiver:
+    # level-4 receiver for an unbounded sample stream: chunks are written into a fixed-size
+    # ring buffer, preambles are searched incrementally as samples arrive, and every packet is
+    # decoded as soon as its last sample is in, so memory does not grow with the capture.
+    # With a traceback_depth the payload is instead decoded symbol by symbol as its samples
+    # arrive, through a windowed viterbi decoder of that depth (True for its default depth)
+    def __init__(self, phy=None, capacity=None, threshold=0.6, decoding='hard', raw=False, traceback_depth=None):
+        self.phy = phy if phy is not None else WifiPhy()
+        self.threshold = threshold
+        self.decoding = decoding
+        self.raw = raw
+        self.decoder = None
+        if traceback_depth is not None:
+            depth = None if traceback_depth is True else traceback_depth
+            self.decoder = WindowedViterbi(self.phy.trellis_tables, depth, decoding)
+        self.packet = None  # windowed decoding state of the pending packet
+        self.preamble_length = len(self.phy.preamble_time)
+
+        # room for the longest legal packet plus the same again, so a packet can always finish
+        max_packet = self.preamble_length + int(self.phy.packet_span_for_length(MAX_MESSAGE_LENGTH))
+        self.capacity = max(capacity or 0, 2 * max_packet)
+        self.buffer = np.zeros(self.capacity, dtype=complex)
+        self.head = 0       # ring index of the oldest buffered sample
+        self.size = 0       # number of buffered samples
+        self.offset = 0     # stream offset of the oldest buffered sample
+        self.scanned = 0    # buffered samples already ruled out as preamble starts
+        self.pending = None  # buffer position of a detected preamble waiting for its packet
+        self.span = None     # samples after the pending preamble, once its length field is read
+
+    def feed(self, chunk):
+        # add samples and yield (offset, message, length) for every packet they complete
+        chunk = np.asarray(chunk)
+        while len(chunk):
+            count = min(len(chunk), self.capacity - self.size)
+            if count == 0:
+                raise Exception("Error: streaming buffer is full and no buffered packet can complete")
+            self._write(chunk[:count])
+            chunk = chunk[count:]
+            yield from self._process()
+
+    def flush(self):
+        # end of stream: decode a packet that was cut short, zero-filling its missing samples
+        if self.pending is not None and self.size - self.pending >= self.preamble_length + self.phy.nfft:
+            span = self.span if self.span is not None else self._packet_span(self.pending)
+            if span is not None:
+                window = np.zeros(self.preamble_length + span, dtype=complex)
+                available = self._window(self.pending, min(len(window), self.size - self.pending))
+                window[:len(available)] = available
+                _, message, length = self.phy.receive_at(window, [0], self.decoding, self.raw)[0]
+                yield self.offset + self.pending, message, length
+        self._discard(self.size)
+        self.pending = None
+        self.span = None
+        self.packet = None
+
+    def _process(self):
+        while True:
+            if self.pending is None:
+                start = self._search()
+                if start is None:
+                    return
+                # drop the samples before the preamble, so the packet always has room to finish
+                self.pending = start
+                self._discard(start)
+
+            if self.span is None:
+                # the length field is read once, not again on every chunk the packet waits for
+                span = self._packet_span(self.pending)
+                if span is False:
+                    return  # length field not fully received yet
+                if span is None:
+                    # the length field is not a legal length, so this was not a real preamble
+                    self.scanned = self.pending + 1
+                    self.pending = None
+                    continue
+                self.span = span
+
+            end = self.pending + self.preamble_length + self.span
+            if self.decoder is not None:
+                self._decode_payload(end)
+            if end > self.size:
+                return  # wait for the rest of the packet
+
+            if self.decoder is not None:
+                message, length = self._finish_payload()
+            else:
+                _, message, length = self.phy.receive_at(self._window(self.pending, end - self.pending), [0], self.decoding, self.raw)[0]
+            yield self.offset + self.pending, message, length
+            self._discard(end)
+            self.pending = None
+            self.span = None
+            self.packet = None
+
+    def _decode_payload(self, end):
+        # push the whole payload OFDM symbols buffered so far through the windowed decoder;
+        # packet holds the length field bits, the stream offset of the next undecoded symbol,
+        # the decided bits and (soft) the LLR scale taken from the length field
+        nfft = self.phy.nfft
+        if self.packet is None:
+            symbol_start = self.pending + self.preamble_length
+            weights = self.phy.channel_weights(self._window(self.pending, self.preamble_length)[None, :])
+            length_symbol = self._equalized(np.fft.fft(self._window(symbol_start, nfft)), weights)
+            reference = self.phy.demodulate_soft(length_symbol) if self.decoding == 'soft' else None
+            self.packet = {"encoded_length": self.phy.length_bits(length_symbol, self.decoding), "next": self.offset + symbol_start + nfft,
+                           "bits": [], "reference": reference, "weights": weights}
+            self.decoder.reset()
+
+        start = self.packet["next"] - self.offset
+        count = (min(end, self.size) - start) // nfft * nfft
+        if count <= 0:
+            return
+        symbols = self.phy.ofdm.demodulate(self._window(start, count))
+        if self.packet["weights"] is not None:
+            equalize(symbols[None, :], self.packet["weights"])
+        if self.decoding == 'soft':
+            values = quantize_llrs(self.phy.demodulate_soft(symbols), reference=self.packet["reference"])
+        else:
+            values = self.phy.demodulate_hard(symbols)
+        self.packet["bits"].append(self.decoder.push(values))
+        self.packet["next"] += count
+
+    def _finish_payload(self):
+        bits = np.concatenate(self.packet["bits"] + [self.decoder.flush()])
+        payloads, lengths = self.phy.level1_decode(self.packet["encoded_length"][None, :], bits[None, :])
+        return (payloads[0] if self.raw else payloads[0].decode('latin-1')), int(lengths[0])
+
+    def _search(self):
+        # normalized-correlation peaks over the samples not yet ruled out; a peak is only
+        # trusted once a full preamble length of samples after it has been seen as well
+        preamble_length = self.preamble_length
+        if self.size - self.scanned < 2 * preamble_length:
+            return None
+
+        window = self._window(self.scanned, self.size - self.scanned)
+        confirmed = len(window) - 2 * preamble_length + 1
+        starts = find_packet_starts(window, self.phy.preamble_time, self.threshold)
+        starts = starts[starts < confirmed]
+        if len(starts):
+            return self.scanned + int(starts[0])
+
+        # nothing here: drop everything that can no longer be the start of a preamble
+        self.scanned += confirmed
+        self._discard(self.scanned)
+        return None
+
+    def _packet_span(self, start):
+        # samples after the preamble announced by the length field; False if it has not
+        # arrived yet, None if it decodes to an impossible length
+        symbol_start = start + self.preamble_length
+        if self.size - symbol_start < self.phy.nfft:
+            return False
+        weights = self.phy.channel_weights(self._window(start, self.preamble_length)[None, :])
+        length = self.phy.decode_length(self.phy.length_bits(self._equalized(np.fft.fft(self._window(symbol_start, self.phy.nfft)), weights)))
+        if length > MAX_MESSAGE_LENGTH:
+            return None
+        return int(self.phy.packet_span_for_length(length))
+
+    def _equalized(self, symbols, weights):
+        # frequency-domain symbols as the equalizing receiver sees them (as they are without one)
+        if weights is None:
+            return symbols
+        return equalize(symbols[None, :].copy(), weights)[0]
+
+    def _write(self, samples):
+        tail = (self.head + self.size) % self.capacity
+        first = min(len(samples), self.capacity - tail)
+        self.buffer[tail:tail + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self.size += len(samples)
+
+    def _window(self, start, count):
+        # buffered samples [start, start + count) as one array (a copy only if they wrap)
+        begin = (self.head + start) % self.capacity
+        if begin + count <= self.capacity:
+            return self.buffer[begin:begin + count]
+        return np.concatenate((self.buffer[begin:], self.buffer[:begin + count - self.capacity]))
+
+    def _discard(self, count):
+        self.head = (self.head + count) % self.capacity
+        self.size -= count
+        self.offset += count
+        self.scanned = max(self.scanned - count, 0)
+        if self.pending is not None:
+            self.pending -= count
+
+
+def iter_chunks(source, chunk_samples=4096, dtype=np.complex64):
+    # sample chunks from a binary file-like object (open(path, 'rb'), socket.makefile('rb'), ...)
+    itemsize = np.dtype(dtype).itemsize
+    leftover = b""
+    while True:
+        data = source.read(chunk_samples * itemsize)
+        if not data:
+            break
+        data = leftover + data
+        usable = len(data) - len(data) % itemsize
+        leftover = data[usable:]
+        if usable:
+            yield np.frombuffer(data[:usable], dtype=dtype)
+
+
+def receive_stream(chunks, phy=None, **kwargs):
+    # generator over (offset, message, length) for an iterable of sample chunks
+    receiver = StreamingReceiver(phy, **kwargs)
+    for chunk in chunks:
+        yield from receiver.feed(chunk)
+    yield from receiver.flush()
+
+
+# stream a synthetic capture through a file-like source in small chunks
+if __name__ == "__main__":
+    import contextlib
+    import io
+
+    num_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    phy = WifiPhy()
+    rng = np.random.default_rng(0)
+    messages = ["".join(chr(c) for c in rng.integers(32, 127, int(rng.integers(1, 400)))) for _ in range(num_packets)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        capture = np.concatenate([phy.transmit(message, 4, 15) for message in messages]).astype(np.complex64)
+
+    receiver = StreamingReceiver(phy)
+    source = io.BytesIO(capture.tobytes())
+    decoded = []
+    for chunk in iter_chunks(source, 1000):
+        decoded.extend(receiver.feed(chunk))
+    decoded.extend(receiver.flush())
+
+    correct = sum(result[1] == message for result, message in zip(decoded, messages))
+    print(f"{len(decoded)} packets found, {correct}/{num_packets} decoded correctly")
+    print(f"Capture {capture.nbytes / 1e6:.1f} MB, ring buffer {receiver.buffer.nbytes / 1e6:.1f} MB")
+
+    # a long packet found late in a single large chunk must not be stuck behind the samples before it
+    receiver = StreamingReceiver(phy, capacity=160512)
+    with contextlib.redirect_stdout(io.StringIO()):
+        packet = phy.transmit("x" * 10000, 4)
+    late = list(receiver.feed(np.concatenate((np.zeros(receiver.capacity - 60000, dtype=complex), packet)))) + list(receiver.flush())
+    print("Long packet late in one chunk:", [result[1] for result in late] == ["x" * 10000])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import bisect
+import sys
+import time
+import numpy as np
+
+
+def cross_correlate(signal, template, block_size=4096):
+    # c[..., i] = sum_j signal[..., i + j] * conj(template[j]) for every full overlap,
+    # computed with overlap-save so the FFT size stays fixed however long the capture is
+    signal = np.asarray(signal)
+    template = np.asarray(template)
+    template_length = len(template)
+    num_outputs = signal.shape[-1] - template_length + 1
+    if num_outputs <= 0:
+        return np.zeros(signal.shape[:-1] + (0,), dtype=complex)
+
+    fft_size = max(block_size, 1 << int(np.ceil(np.log2(2 * template_length))))
+    step = fft_size - template_length + 1
+    num_blocks = -(-num_outputs // step)
+
+    # pad so the last block is full, then view the stream as overlapping blocks
+    padded_length = (num_blocks - 1) * step + fft_size
+    pad = [(0, 0)] * (signal.ndim - 1) + [(0, padded_length - signal.shape[-1])]
+    padded = np.pad(signal, pad, 'constant')
+    blocks = np.lib.stride_tricks.sliding_window_view(padded, fft_size, axis=-1)[..., ::step, :]
+
+    # circular correlation per block, keeping only the outputs that did not wrap around
+    kernel = np.conj(np.fft.fft(template, fft_size))
+    correlation = np.fft.ifft(np.fft.fft(blocks, axis=-1) * kernel, axis=-1)[..., :step]
+    correlation = correlation.reshape(signal.shape[:-1] + (num_blocks * step,))
+    return correlation[..., :num_outputs]
+
+
+def window_energy(signal, window_length):
+    # energy of every length-window_length window, via a running sum of |x|^2
+    power = np.abs(np.asarray(signal)) ** 2
+    cumulative = np.cumsum(power, axis=-1)
+    zeros = np.zeros(cumulative.shape[:-1] + (1,))
+    cumulative = np.concatenate((zeros, cumulative), axis=-1)
+    return cumulative[..., window_length:] - cumulative[..., :-window_length]
+
+
+def find_start_index(signal, preamble):
+    # offset minimizing the squared distance between the window and the preamble:
+    # sum|w - p|^2 = sum|w|^2 - 2 Re<w, p> + sum|p|^2, which is zero at the true start of a
+    # noiseless stream (like the old sliding absolute difference) and the matched filter under AWGN
+    if signal.shape[-1] < len(preamble):
+        return 0 if signal.ndim == 1 else np.zeros(signal.shape[:-1], dtype=int)
+
+    correlation = cross_correlate(signal, preamble)
+    distance = window_energy(signal, len(preamble)) - 2 * correlation.real + np.sum(np.abs(preamble) ** 2)
+    best_index = np.argmin(distance, axis=-1)
+    return int(best_index) if signal.ndim == 1 else best_index
+
+
+def find_first_path(signal, preamble, max_delay, fraction=0.5):
+    # start of the preamble over a multipath channel, where the squared distance of
+    # find_start_index fails because the channel rotates and mixes the preamble: the
+    # correlation magnitude peaks at the strongest path, and the start is the earliest offset
+    # up to max_delay before that peak whose magnitude reaches fraction of it
+    if signal.shape[-1] < len(preamble):
+        return 0 if signal.ndim == 1 else np.zeros(signal.shape[:-1], dtype=int)
+
+    magnitude = np.abs(cross_correlate(signal, preamble))
+    peak = np.argmax(magnitude, axis=-1)[..., None]
+    offsets = np.arange(magnitude.shape[-1])
+    strong = magnitude >= fraction * magnitude.max(axis=-1, keepdims=True)
+    first = np.argmax(strong & (offsets >= peak - max_delay) & (offsets <= peak), axis=-1)
+    return int(first) if signal.ndim == 1 else first
+
+
+def find_packet_starts(signal, preamble, threshold=0.6, min_distance=None):
+    # every offset where the normalized correlation with the preamble peaks above threshold,
+    # for scanning a continuous capture that holds several packets
+    if min_distance is None:
+        min_distance = len(preamble)
+    if len(signal) < len(preamble):
+        return np.zeros(0, dtype=int)
+
+    # windows of (near) silence are floored so FFT round-off there cannot score as a match
+    preamble_energy = np.sum(np.abs(preamble) ** 2)
+    correlation = np.abs(cross_correlate(signal, preamble))
+    energy = np.maximum(window_energy(signal, len(preamble)), 1e-6 * preamble_energy)
+    score = correlation / np.sqrt(energy * preamble_energy)
+
+    # keep the strongest candidates first, dropping any within min_distance of an accepted peak;
+    # the accepted starts are kept sorted, so only the two neighbours of a candidate can be close
+    candidates = np.flatnonzero(score >= threshold)
+    candidates = candidates[np.argsort(-score[candidates], kind='stable')]
+    starts = []
+    for index in candidates.tolist():
+        position = bisect.bisect_left(starts, index)
+        if position > 0 and index - starts[position - 1] < min_distance:
+            continue
+        if position < len(starts) and starts[position] - index < min_distance:
+            continue
+        starts.insert(position, index)
+
+    return np.array(starts, dtype=int)
+
+
+# compare against the sliding-window search and check detection under noise
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import commpy as comm
+    from wifitransmitter import WifiTransmitter
+
+    def sliding_start_index(signal, preamble):
+        best_index = 0
+        min_difference = np.inf
+        for i in range(len(signal) - len(preamble) + 1):
+            difference = np.sum(np.abs(signal[i:i + len(preamble)] - preamble))
+            if difference < min_difference:
+                min_difference = difference
+                best_index = i
+        return best_index
+
+    message = sys.argv[1] if len(sys.argv) > 1 else "x" * 2000
+    preamble_bits = np.array([1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1] * 2)
+    preamble = np.fft.ifft(comm.modulation.QAMModem(4).modulate(preamble_bits.astype(bool)))
+
+    for snr in [np.inf, 20, 10, 5, 0]:
+        packets = []
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            for _ in range(3):
+                packets.append(WifiTransmitter(message, 4) if snr == np.inf else WifiTransmitter(message, 4, snr))
+        pads = [int(line.split(":")[1]) for line in log.getvalue().splitlines() if line.startswith("Noise Padding Begin")]
+
+        stream = packets[0]
+        start = time.perf_counter()
+        fft_index = find_start_index(stream, preamble)
+        fft_time = time.perf_counter() - start
+
+        line = f"SNR {snr}: true {pads[0]}, fft {fft_index} ({fft_time * 1e3:.2f} ms)"
+        if snr == np.inf:
+            start = time.perf_counter()
+            sliding_index = sliding_start_index(stream, preamble)
+            line += f", sliding {sliding_index} ({(time.perf_counter() - start) * 1e3:.2f} ms)"
+
+        # continuous capture of three back-to-back packets
+        capture = np.concatenate(packets)
+        expected = np.cumsum([0] + [len(p) for p in packets[:-1]]) + np.array(pads)
+        found = find_packet_starts(capture, preamble)
+        line += f", multi-packet {found.tolist()} (expected {expected.tolist()})"
+        print(line)
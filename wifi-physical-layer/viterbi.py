@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import sys
+import time
+import numpy as np
+
+# predecessor view of a trellis, built once and reused for every decode
+TrellisTables = namedtuple("TrellisTables", ["num_states", "k", "n", "pred_state", "pred_input", "pred_output", "output_bits"])
+
+
+def build_trellis_tables(trellis):
+    num_states = trellis.number_states
+    k, n = trellis.k, trellis.n
+
+    # collect the incoming branches of every state, visiting them in the same order
+    # as my_hard_vdecoder so ties are resolved identically (lowest previous state wins)
+    incoming = [[] for _ in range(num_states)]
+    for prev_state in range(num_states):
+        for input_bit in range(2 ** k):
+            next_state = trellis.next_state_table[prev_state, input_bit]
+            incoming[next_state].append((prev_state, input_bit, trellis.output_table[prev_state, input_bit]))
+
+    if len(set(len(branches) for branches in incoming)) != 1:
+        raise Exception("Error: Trellis states must all have the same number of predecessors")
+
+    branches = np.array(incoming, dtype=np.int64)  # (num_states, num_preds, 3)
+    pred_state = branches[:, :, 0]
+    pred_input = branches[:, :, 1]
+    pred_output = branches[:, :, 2]
+
+    # expected output bits (MSB first, like np.binary_repr) for every output symbol
+    output_bits = (np.arange(2 ** n)[:, None] >> np.arange(n - 1, -1, -1)) & 1
+
+    return TrellisTables(num_states, k, n, pred_state, pred_input, pred_output, output_bits.astype(np.int8))
+
+
+def hard_vdecoder(bits, tables):
+    # same decisions as my_hard_vdecoder, but add-compare-select runs over all states at once;
+    # bits may also be a (batch, num_bits) array of equal-length messages, decoded together
+    received, batched = _received_groups(bits, tables.n)
+    decoded_bits = _viterbi(_hard_distances(received, tables), tables, np.int32)
+    return decoded_bits if batched else decoded_bits[0]
+
+
+def quantize_llrs(llrs, max_level=7, reference=None):
+    # scale LLRs (positive favours a 1, like commpy's soft demodulator) so the mean magnitude of
+    # each message lands mid-range, then round and clip to +-max_level in an int8 array; LLRs
+    # that arrive in pieces take the mean magnitude of reference instead, so every piece is
+    # scaled alike
+    llrs = np.asarray(llrs, dtype=float)
+    reference = np.abs(np.asarray(reference if reference is not None else llrs, dtype=float))
+    magnitude = reference.mean(axis=-1, keepdims=True) if reference.shape[-1] else np.ones(reference.shape[:-1] + (1,))
+    scale = max_level / (2 * np.maximum(magnitude, 1e-12))
+    return np.clip(np.rint(llrs * scale), -max_level, max_level).astype(np.int8)
+
+
+def soft_vdecoder(llrs, tables):
+    # soft-decision viterbi over quantized LLRs (see quantize_llrs), one message or a
+    # (batch, num_llrs) array; a branch costs the LLR magnitudes of the bits it disagrees with,
+    # which reduces to the hamming distance when every magnitude is 1
+    received, batched = _received_groups(llrs, tables.n)
+    decoded_bits = _viterbi(_soft_distances(received, tables), tables, np.int16)
+    return decoded_bits if batched else decoded_bits[0]
+
+
+class WindowedViterbi:
+    # sliding-window decoder for one unbounded stream of hard bits or quantized LLRs: pushed
+    # groups go through add-compare-select as they arrive, their decisions into a uint8 store
+    # of 2 * depth steps. Each time the store fills, the oldest depth bits are traced back from
+    # the best current state and returned, so memory does not grow with the stream and the
+    # output lags the input by depth to 2 * depth steps. With a depth beyond the message length
+    # the result is hard_vdecoder's/soft_vdecoder's
+    def __init__(self, tables, depth=None, decoding='hard'):
+        if decoding not in ('hard', 'soft'):
+            raise Exception("Error: decoding must be 'hard' or 'soft'")
+        self.tables = tables
+        self.decoding = decoding
+        # 5 constraint lengths, the constraint length being the input plus the register bits
+        constraint_length = tables.k + int(np.log2(tables.num_states))
+        self.depth = depth or 5 * constraint_length
+        self.pred_state = tables.pred_state.T
+        self.pred_output = tables.pred_output.T
+        self.pred_input = tables.pred_input.astype(np.uint8)
+        self.decisions = np.zeros((2 * self.depth, tables.num_states), dtype=np.uint8)
+        self.reset()
+
+    def reset(self):
+        # back to the zero state, for the next message
+        self.path_metrics = np.full(self.tables.num_states, np.iinfo(np.int32).max // 4, dtype=np.int32)
+        self.path_metrics[0] = 0
+        self.steps = 0
+        self.leftover = np.zeros(0, dtype=np.int8)
+
+    def push(self, values):
+        # add received bits (or LLRs) and return the bits decided by them, as uint8
+        values = np.concatenate((self.leftover, np.asarray(values).astype(np.int8, copy=False)))
+        usable = len(values) - len(values) % self.tables.n
+        self.leftover = values[usable:]
+        received, _ = _received_groups(values[:usable], self.tables.n)
+        distances = _hard_distances(received, self.tables) if self.decoding == 'hard' else _soft_distances(received, self.tables)
+
+        output = []
+        two_preds = len(self.pred_state) == 2
+        for branch_metrics in distances[:, 0]:
+            candidates = self.path_metrics[self.pred_state] + branch_metrics[self.pred_output]
+            if two_preds:
+                self.decisions[self.steps] = candidates[1] < candidates[0]
+                self.path_metrics = np.minimum(candidates[0], candidates[1])
+            else:
+                self.decisions[self.steps] = candidates.argmin(axis=0)
+                self.path_metrics = candidates.min(axis=0)
+            self.path_metrics -= self.path_metrics.min()
+            self.steps += 1
+            if self.steps == len(self.decisions):
+                output.append(self._traceback(self.depth))
+        return np.concatenate(output) if output else np.zeros(0, dtype=np.uint8)
+
+    def flush(self):
+        # end of message: the remaining bits, traced back from the best final state
+        output = self._traceback(self.steps)
+        self.reset()
+        return output
+
+    def _traceback(self, count):
+        # bits of the oldest count stored steps along the best path; they leave the store
+        # (on python lists: the walk is one scalar lookup per step, where numpy indexing is slow)
+        decisions = self.decisions[:self.steps].tolist()
+        pred_input, pred_state = self.pred_input.tolist(), self.tables.pred_state.tolist()
+        bits = [0] * self.steps
+        state = int(np.argmin(self.path_metrics))
+        for t in range(self.steps - 1, -1, -1):
+            decision = decisions[t][state]
+            bits[t] = pred_input[state][decision]
+            state = pred_state[state][decision]
+        self.decisions[:self.steps - count] = self.decisions[count:self.steps]
+        self.steps -= count
+        return np.array(bits[:count], dtype=np.uint8)
+
+
+def _hard_distances(received, tables):
+    # hamming distance of every received n-bit group to every possible branch output
+    return (received[:, :, None, :] != tables.output_bits).sum(axis=3, dtype=np.int8)
+
+
+def _soft_distances(received, tables):
+    # summed LLR magnitudes of the bits each branch output disagrees with
+    weights = np.abs(received.astype(np.int16))
+    disagree = (received[:, :, None, :] > 0) != tables.output_bits.astype(bool)
+    branch_dtype = np.int8 if tables.n * int(weights.max(initial=0)) <= np.iinfo(np.int8).max else np.int16
+    return (disagree * weights[:, :, None, :]).sum(axis=3, dtype=branch_dtype)
+
+
+def _received_groups(values, n):
+    # (num_steps, batch, n) view of one message or a batch of equal-length messages
+    values = np.asarray(values)
+    batched = values.ndim == 2
+    if not batched:
+        values = values[None, :]
+    num_steps = values.shape[1] // n
+    received = values[:, :num_steps * n].reshape(len(values), num_steps, n).transpose(1, 0, 2)
+    if not np.issubdtype(received.dtype, np.integer):
+        received = received.astype(np.int8)
+    return received, batched
+
+
+def _viterbi(distances, tables, metric_dtype):
+    # forward pass and traceback for branch metrics given per received group and per branch
+    # output symbol, (num_steps, batch, 2**n); branch metrics stay in the small dtype they come
+    # in, path metrics use metric_dtype
+    num_steps, batch = distances.shape[:2]
+    num_states = tables.num_states
+    if num_steps == 0:
+        return np.zeros((batch, 0), dtype=int)
+
+    # gathered per (predecessor, state) so the forward pass only does lookups
+    branch_metrics = distances[:, :, tables.pred_output.T].transpose(0, 2, 1, 3).reshape(num_steps, -1, batch * num_states)
+
+    # path metrics of all messages live in one flat (batch * num_states) array, and the
+    # predecessors become a (num_preds, batch * num_states) gather index into it
+    offsets = np.repeat(np.arange(batch) * num_states, num_states)
+    pred_index = offsets + np.tile(tables.pred_state.T, batch)
+    two_preds = len(pred_index) == 2
+
+    # unreachable states start far above any reachable path metric; metrics are re-based on
+    # each message's best state often enough that a narrow dtype cannot overflow
+    ceiling = np.iinfo(metric_dtype).max // 4
+    normalize_every = max(1, ceiling // max(int(distances.max()), 1))
+    path_metrics = np.full((batch, num_states), ceiling, dtype=metric_dtype)
+    path_metrics[:, 0] = 0
+    path_metrics = path_metrics.reshape(-1)
+    decisions = np.zeros((num_steps, batch * num_states), dtype=np.uint8)
+
+    # forward pass: add-compare-select for every state (and every message) in one step;
+    # a later predecessor only wins if strictly better, so ties keep the lowest one
+    for t in range(num_steps):
+        candidates = path_metrics[pred_index] + branch_metrics[t]
+        if two_preds:
+            decisions[t] = candidates[1] < candidates[0]
+            path_metrics = np.minimum(candidates[0], candidates[1])
+        else:
+            decisions[t] = candidates.argmin(axis=0)
+            path_metrics = candidates.min(axis=0)
+        if t % normalize_every == normalize_every - 1:
+            path_metrics -= np.repeat(path_metrics.reshape(batch, num_states).min(axis=1), num_states)
+
+    # backtrack from the best final state through flat predecessor pointers (built in place as
+    # one (num_steps, batch * num_states) array of the narrowest integer type that can index
+    # it), then read the input bit of every chosen branch in one gather
+    index_dtype = np.int16 if batch * num_states <= np.iinfo(np.int16).max else np.int32
+    state_index = np.tile(np.arange(num_states), batch)
+    if two_preds:
+        # pred_state[s, d] = first + d * (second - first), so no intp gather index is needed
+        first = (offsets + tables.pred_state[state_index, 0]).astype(index_dtype)
+        prev_index = decisions.astype(index_dtype)
+        prev_index *= (tables.pred_state[state_index, 1] - tables.pred_state[state_index, 0]).astype(index_dtype)
+        prev_index += first
+    else:
+        prev_index = tables.pred_state.astype(index_dtype)[state_index, decisions]
+        prev_index += offsets.astype(index_dtype)
+    path = np.zeros((num_steps, batch), dtype=index_dtype)
+    state = (np.arange(batch) * num_states + np.argmin(path_metrics.reshape(batch, num_states), axis=1)).astype(index_dtype)
+    for t in range(num_steps - 1, -1, -1):
+        path[t] = state
+        state = prev_index[t][state]
+    steps = np.arange(num_steps)[:, None]
+    return tables.pred_input.astype(np.uint8)[path % num_states, decisions[steps, path]].T
+
+
+# benchmark against the reference decoder in wifireceiver.py
+if __name__ == "__main__":
+    import commpy.channelcoding.convcode as check
+    from wifireceiver import my_hard_vdecoder
+
+    num_bits = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    cc1 = check.Trellis(np.array([3]), np.array([[0o7, 0o5]]))
+    tables = build_trellis_tables(cc1)
+
+    rng = np.random.default_rng(0)
+    message = rng.integers(0, 2, num_bits)
+    coded = check.conv_encode(message.astype(bool), cc1)[:-6]
+    flips = rng.random(len(coded)) < 0.02
+    coded = np.where(flips, 1 - coded, coded)
+
+    start = time.perf_counter()
+    reference = my_hard_vdecoder(coded, cc1)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = hard_vdecoder(coded, tables)
+    vectorized_time = time.perf_counter() - start
+
+    print("Bit-exact:", np.array_equal(reference, decoded))
+    print("Bit errors vs message:", int(np.sum(decoded != message)))
+    print(f"my_hard_vdecoder: {num_bits / reference_time:,.0f} decoded bits/sec")
+    print(f"hard_vdecoder:    {num_bits / vectorized_time:,.0f} decoded bits/sec")
+    print(f"Speedup: {reference_time / vectorized_time:.1f}x")
+
+    # coded BER of hard and soft decoding over QPSK + AWGN, with soft decoder throughput
+    import commpy as comm
+    from phy import WifiPhy
+
+    phy = WifiPhy()
+    message = rng.integers(0, 2, 50000)
+    symbols = phy.modem.modulate(check.conv_encode(message.astype(bool), cc1)[:-6])
+    print("SNR(dB)  hard BER   soft BER")
+    soft_time = hard_time = 0
+    for snr in range(0, 9):
+        received = comm.channels.awgn(symbols, snr)
+        start = time.perf_counter()
+        hard = hard_vdecoder(phy.demodulate_hard(received), tables)
+        hard_time += time.perf_counter() - start
+        start = time.perf_counter()
+        soft = soft_vdecoder(quantize_llrs(phy.demodulate_soft(received)), tables)
+        soft_time += time.perf_counter() - start
+        print(f"{snr:7d}  {np.mean(hard != message):.2e}   {np.mean(soft != message):.2e}")
+    print(f"Demodulate + decode: hard {9 * len(message) / hard_time:,.0f} bits/sec, soft {9 * len(message) / soft_time:,.0f} bits/sec")
+
+    # windowed decoding of the same long hard-decision stream, pushed in 256-bit pieces
+    import tracemalloc
+    message = rng.integers(0, 2, 200000)
+    coded = check.conv_encode(message.astype(bool), cc1)[:-6]
+    coded = np.where(rng.random(len(coded)) < 0.03, 1 - coded, coded)
+    for name, decode in (("hard_vdecoder", lambda: hard_vdecoder(coded, tables)),
+                         ("WindowedViterbi", lambda: np.concatenate([decoder.push(coded[i:i + 256]) for i in range(0, len(coded), 256)] + [decoder.flush()]))):
+        decoder = WindowedViterbi(tables)
+        start = time.perf_counter()
+        decoded = decode()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        decode()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:15}: {len(message) / elapsed:,.0f} bits/sec, peak {peak / 1e6:.2f} MB, BER {np.mean(decoded != message):.2e}")
@@ -1,28 +1,10 @@
 # -*- coding: utf-8 -*-
-from random import randint
 import numpy as np
-import sys
-import commpy as comm
-import commpy.channelcoding.convcode as check
-from pip import main
-import matplotlib.pyplot as plt
+from phy import shared_phy
+from sync import find_start_index
 
-
-def find_start_index(signal, preamble):
-    best_index = 0
-    min_difference = np.inf
-
-    # sliding window to find the best match for the preamble
-    for i in range(len(signal) - len(preamble) + 1):
-        window = signal[i:i + len(preamble)]
-        # measure similarity using absolute difference
-        difference = np.sum(np.abs(window - preamble))
-
-        if difference < min_difference:
-            min_difference = difference
-            best_index = i
-
-    return best_index
+# find_start_index is re-exported for callers of the original receiver
+__all__ = ["find_start_index", "my_hard_vdecoder", "WifiReceiver", "receive_batch"]
 
 
 def my_hard_vdecoder(bits, trellis):
@@ -71,105 +53,24 @@ def my_hard_vdecoder(bits, trellis):
     return np.array(decoded_bits, dtype=int)
 
 
-def WifiReceiver(input_stream, level):
-    nfft = 64
-    Interleave_tr = np.reshape(np.transpose(np.reshape(np.arange(1, 2*nfft+1, 1),[-1,4])),[-1,])
-    preamble = np.array([1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1,1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1])
-    cc1 = check.Trellis(np.array([3]),np.array([[0o7,0o5]]))
-
-    # set zero padding to be 0, by default
-    begin_zero_padding = 0
-    message = ""
-    length = 0
-
-    if level >= 4:
-        #Input QAM modulated + Encoded Bits + OFDM Symbols in a long stream
-        #Output Detected Packet set of symbols
-
-        # make preamble into the same format as the input stream to find initial padding
-        mod = comm.modulation.QAMModem(4)
-        preamble = mod.modulate(preamble.astype(bool))
-        nsym = int(len(preamble)/nfft)
-        for i in range(nsym):
-            symbol = preamble[i*nfft:(i+1)*nfft]
-            preamble[i*nfft:(i+1)*nfft] = np.fft.ifft(symbol)
-
-        # remove initial padding
-        begin_zero_padding = find_start_index(input_stream, preamble)
-        input_stream = input_stream[begin_zero_padding:]
-        input_stream = input_stream[len(preamble):]
-
-    if level >= 3:
-        #Input QAM modulated + Encoded Bits + OFDM Symbols
-        #Output QAM modulated + Encoded Bits
-
-        # use FFT to switch to frequency domain
-        nsym = int(len(input_stream)/nfft)
-        for i in range(nsym):
-            symbol = input_stream[i*nfft:(i+1)*nfft]
-            input_stream[i*nfft:(i+1)*nfft] = np.fft.fft(symbol)
-
-    if level >= 2:
-        #Input QAM modulated + Encoded Bits
-        #Output Interleaved bits + Encoded Length
-
-        # demodulate the stream
-        mod = comm.modulation.QAMModem(4)
-        demod = mod.demodulate(input_stream, demod_type='hard')
-
-        # preamble is already removed from the stream in level 4
-        if level <= 3:
-            demod = demod[len(preamble):]
-
-        # split into encoded length and message
-        encoded_length = demod[:2*nfft]
-        message = demod[2*nfft:]
-
-        # viterbi decode to get interleaved bits (which are handled by level 1)
-        decoded_bits = my_hard_vdecoder(message, cc1)
-
-        # prepare input for level 1 handling
-        input_stream = np.concatenate((encoded_length, decoded_bits))
-
-    if level >= 1:
-        #Input Interleaved bits + Encoded Length
-        #Output Deinterleaved bits
-
-        # first 128 bits of the stream represent the encoded length
-        encoded_length = input_stream[:2*nfft]
-        length_bin = ''
-        for i in range(0, len(encoded_length), 3):
-            # majority vote for each 3 bits
-            bits = encoded_length[i:i+3]
-            b = '0' if np.sum(bits) < 2 else '1'
-            length_bin += b
-        length = int(length_bin, 2)
-
-        # remaining stream is message split in interleaved 2*nfft bit chunks
-        chunks = input_stream[2*nfft:]
-        deinterleave = np.zeros_like(Interleave_tr)
-        deinterleave[Interleave_tr-1] = np.arange(2 * nfft)
-
-        # deinterleave the stream
-        nsym = len(chunks) // (2 * nfft)
-        deinterleaved = np.zeros_like(chunks, dtype=np.int8)
-        for i in range(nsym):
-            chunk = chunks[i * 2 * nfft:(i + 1) * 2 * nfft]
-            deinterleaved[i * 2 * nfft:(i + 1) * 2 * nfft] = chunk[deinterleave]
-
-        # remove any padding and convert bits to ASCII characters
-        n_bits = length * 8
-        bits = deinterleaved[:n_bits].astype(np.int8)
-        message = ''.join([chr(b) for b in np.packbits(bits).tolist()])
-
-        return begin_zero_padding, message, length
-
-    raise Exception("Error: Unsupported level")
+def WifiReceiver(input_stream, level, decoding='hard', raw=False, nfft=64, recorder=None):
+    # the shared session caches the interleaver, preamble, trellis and modem across calls
+    # decoding='soft' feeds LLRs into the viterbi decoder instead of hard bits, raw=True
+    # returns the message as bytes, nfft must match the transmitter's symbol size and
+    # recorder (an instrument.StageRecorder) collects per-stage timings
+    with shared_phy(nfft).recording(recorder) as phy:
+        return phy.receive(input_stream, level, decoding, raw)
+
+
+def receive_batch(input_streams, level, decoding='hard', raw=False, nfft=64, recorder=None):
+    # decode a list (or 2-D array) of same-level streams in one vectorized call
+    with shared_phy(nfft).recording(recorder) as phy:
+        return phy.receive_batch(input_streams, level, decoding, raw)
 
 
 # for testing purpose
-from wifitransmitter import WifiTransmitter
 if __name__ == "__main__":
+    from wifitransmitter import WifiTransmitter
     test_case = 'The Internet has transformed our everyday lives, bringing people closer together and powering multi-billion dollar industries. The mobile revolution has brought Internet connectivity to the last-mile, connecting billions of users worldwide. But how does the Internet work? What do oft repeated acronyms like "LTE", "TCP", "WWW" or a "HTTP" actually mean and how do they work? This course introduces fundamental concepts of computer networks that form the building blocks of the Internet. We trace the journey of messages sent over the Internet from bits in a computer or phone to packets and eventually signals over the air or wires. We describe commonalities and differences between traditional wired computer networks from wireless and mobile networks. Finally, we build up to exciting new trends in computer networks such as the Internet of Things, 5-G and software defined networking. Topics include: physical layer and coding (CDMA, OFDM, etc.); data link protocol; flow control, congestion control, routing; local area networks (Ethernet, Wi-Fi, etc.); transport layer; and introduction to cellular (LTE) and 5-G networks. The course will be graded based on quizzes (on canvas), a midterm and final exam and four projects (all individual). '
     print(test_case)
     output = WifiTransmitter(test_case, 2)